@@ -0,0 +1,152 @@
+import argparse
+import glob
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from functools import partial
+
+import pool_worker
+
+
+def _transcribe(audio_file_path, midi_path):
+    start = time.perf_counter()
+    try:
+        piano_format, duration = pool_worker.notes_process().transcribe_file(audio_file_path, midi_path)
+    except Exception as e:
+        return {'input': audio_file_path, 'error': type(e).__name__ + ': ' + str(e),
+                'seconds': time.perf_counter() - start}
+    return {'input': audio_file_path, 'output': midi_path, 'notes': len(piano_format), 'duration': duration,
+            'seconds': time.perf_counter() - start}
+
+
+def _transcribe_group(audio_file_paths, midi_paths):
+    # several files per task: loaded one by one, their Viterbi decoding batched (NotesProcess.transcribe_batch)
+    import librosa
+    start = time.perf_counter()
+    results, ys, srs, loaded = [], [], [], []
+    for audio_file_path, midi_path in zip(audio_file_paths, midi_paths):
+        try:
+            y, sr = librosa.load(audio_file_path)
+        except Exception as e:
+            results.append({'input': audio_file_path, 'error': type(e).__name__ + ': ' + str(e),
+                            'seconds': time.perf_counter() - start})
+            continue
+        ys.append(y)
+        srs.append(sr)
+        loaded.append((audio_file_path, midi_path))
+    try:
+        transcribed = pool_worker.notes_process().transcribe_batch(ys, srs, [midi_path for _, midi_path in loaded])
+    except Exception as e:
+        return results + [{'input': audio_file_path, 'error': type(e).__name__ + ': ' + str(e),
+                           'seconds': time.perf_counter() - start} for audio_file_path, _ in loaded]
+    seconds = time.perf_counter() - start
+    for (audio_file_path, midi_path), (piano_format, duration) in zip(loaded, transcribed):
+        results.append({'input': audio_file_path, 'output': midi_path, 'notes': len(piano_format),
+                        'duration': duration, 'seconds': seconds})
+    return results
+
+
+def _duration(path):
+    # from the file header; unreadable files go last (their load fails anyway)
+    import librosa
+    try:
+        return librosa.get_duration(path=path)
+    except Exception:
+        return float('inf')
+
+
+def expand_inputs(patterns):
+    paths = []
+    for pattern in patterns:
+        # a pattern that matches nothing is kept so it shows up as a failure
+        matches = sorted(glob.glob(pattern, recursive=True)) or [pattern]
+        for path in matches:
+            if not os.path.isdir(path) and path not in paths:
+                paths.append(path)
+    return paths
+
+
+def midi_path_for(audio_file_path, output_dir=None):
+    base = os.path.splitext(os.path.basename(audio_file_path))[0] + '.mid'
+    directory = output_dir if output_dir is not None else os.path.dirname(audio_file_path)
+    return os.path.join(directory, base)
+
+
+def midi_paths_for(paths, output_dir=None):
+    # one .mid per input: inputs that would share one (take.wav and take.m4a, or
+    # same-named files from different directories with -o) get _2, _3... suffixes
+    midi_paths = []
+    used = set()
+    for path in paths:
+        midi_path = midi_path_for(path, output_dir)
+        base, ext = os.path.splitext(midi_path)
+        n = 1
+        while os.path.normcase(os.path.abspath(midi_path)) in used:
+            n += 1
+            midi_path = '{}_{}{}'.format(base, n, ext)
+        used.add(os.path.normcase(os.path.abspath(midi_path)))
+        midi_paths.append(midi_path)
+    return midi_paths
+
+
+def run(paths, jobs=None, output_dir=None, cache_dir=None, report=print, decode_batch=1, pyin_segments=1):
+    if output_dir is not None:
+        os.makedirs(output_dir, exist_ok=True)
+
+    midi_paths = midi_paths_for(paths, output_dir)
+    for path, midi_path in zip(paths, midi_paths):
+        if midi_path != midi_path_for(path, output_dir):
+            report('note {} -> {} (another input has the same name)'.format(path, midi_path))
+
+    results = []
+    # librosa and NotesProcess (with pyin_segments > 1 also its pyin pool) are reused for every file of a worker
+    initializer = partial(pool_worker.init_worker, cache_dir, pyin_segments=pyin_segments)
+    with ProcessPoolExecutor(max_workers=jobs, initializer=initializer) as pool:
+        if decode_batch > 1:
+            # files of similar length together, so a long take does not pad the short ones
+            order = sorted(range(len(paths)), key=lambda i: _duration(paths[i]))
+            groups = [order[i:i + decode_batch] for i in range(0, len(order), decode_batch)]
+            futures = [pool.submit(_transcribe_group, [paths[i] for i in group], [midi_paths[i] for i in group])
+                       for group in groups]
+        else:
+            futures = [pool.submit(_transcribe, path, midi_path) for path, midi_path in zip(paths, midi_paths)]
+        for future in as_completed(futures):
+            group = future.result()
+            for result in (group if isinstance(group, list) else [group]):
+                results.append(result)
+                if 'error' in result:
+                    report('FAIL {input} ({seconds:.2f}s): {error}'.format(**result))
+                else:
+                    report('ok   {input} -> {output}: {notes} notes, {duration:.1f}s of audio in {seconds:.2f}s'.format(**result))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Transcribe many recordings to MIDI, one .mid per input.')
+    parser.add_argument('inputs', nargs='+', help='audio files or glob patterns (e.g. "takes/*.m4a")')
+    parser.add_argument('-j', '--jobs', type=int,
+                        help='worker processes (default: CPUs, divided by --pyin-segments)')
+    parser.add_argument('-o', '--output-dir', help='where to write the .mid files (default: next to each input)')
+    parser.add_argument('--cache-dir', help='feature cache directory')
+    parser.add_argument('--decode-batch', type=int, default=1, metavar='N',
+                        help='files per task, decoded in one batched Viterbi pass (for many short takes)')
+    parser.add_argument('--pyin-segments', type=int, default=1, metavar='N',
+                        help='split each file into N overlapping pieces for pyin, run in parallel (few long files)')
+    args = parser.parse_args()
+
+    paths = expand_inputs(args.inputs)
+    if not paths:
+        parser.error('no input files found')
+
+    jobs = args.jobs or max(1, (os.cpu_count() or 1) // max(1, args.pyin_segments))
+    start = time.perf_counter()
+    results = run(paths, jobs=jobs, output_dir=args.output_dir, cache_dir=args.cache_dir,
+                  decode_batch=args.decode_batch, pyin_segments=args.pyin_segments)
+    failures = [r for r in results if 'error' in r]
+    print('{} files, {} failed, {:.1f}s'.format(len(results), len(failures), time.perf_counter() - start))
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,397 @@
+import argparse
+import datetime
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import librosa
+
+from notes_process import NotesProcess
+from reference import reference_emission
+
+DEFAULT_INPUTS = ['escalamr.wav', 'track3-estrofe.wav', 'Marcha.m4a', 'Marcha2.m4a', 'pastor.m4a', 'Pastor2.m4a']
+DEFAULT_SWEEPS = [10, 30, 60, 120]
+IMPORT_MODULES = ['notes_process', 'note_hmm', 'streaming', 'evaluation', 'feature_cache', 'profiling', 'ring_buffer',
+                  'daemon']
+CLI_COMMANDS = [['wire.py', '--help'], ['wire.py', '--list-devices'], ['cap_audio.py', '--help'], ['batch.py', '--help'],
+                ['sweep.py', '--help'], ['long_file.py', '--help'], ['daemon.py', '--help'], ['evaluation.py', '--help'],
+                ['benchmark.py', '--help']]
+# what makes startup slow; librosa itself loads its submodules lazily
+HEAVY_MODULES = ['librosa.core', 'librosa.feature', 'numba', 'scipy', 'sklearn', 'soundfile', 'sounddevice', 'midiutil',
+                 'matplotlib']
+
+
+def _reset_peak_rss():
+    # Linux: writing 5 to clear_refs resets VmHWM, so each stage gets its own peak
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def _peak_rss_mb():
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    # falls back to the process-wide peak
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class StageTimer():
+
+    def __init__(self, repeat=1):
+        self.repeat = repeat
+        self.stages = {}
+
+    def run(self, name, n_frames, func, *args, **kwargs):
+        best = None
+        peak = 0.0
+        for _ in range(self.repeat):
+            _reset_peak_rss()
+            start = time.perf_counter()
+            result = func(*args, **kwargs)
+            elapsed = time.perf_counter() - start
+            peak = max(peak, _peak_rss_mb())
+            best = elapsed if best is None else min(best, elapsed)
+        fps = n_frames / best if n_frames and best > 0 else None
+        self.stages[name] = {'seconds': best, 'frames_per_second': fps, 'peak_rss_mb': peak}
+        return result
+
+
+def synthetic_sweep(duration, sr=22050, fmin='A2', fmax='E6'):
+    # exponential pitch glide over the whole note range
+    y = librosa.chirp(fmin=librosa.note_to_hz(fmin), fmax=librosa.note_to_hz(fmax), sr=sr, duration=duration)
+    return 0.5 * y.astype(np.float32), sr
+
+
+def bench_signal(name, load, repeat=1):
+    notes_p = NotesProcess()
+    timer = StageTimer(repeat)
+
+    y, sr = timer.run('load', None, load)
+    hop = notes_p.hop_length
+    n_frames = 1 + len(y) // hop
+    fmin = librosa.note_to_hz(notes_p.minimum_note)
+    fmax = librosa.note_to_hz(notes_p.max_note)
+
+    onset_env, onsets_raw, rms, onset_backtrack = timer.run(
+        'onsets', n_frames, notes_p._detect_onsets, y, sr, notes_p.frame_length, hop)
+    f0, voiced_flag, voiced_prob = timer.run(
+        'pyin', n_frames, notes_p._estimate_pitch, y, sr, fmin, fmax, notes_p.frame_length,
+        notes_p.window_length, hop)
+    features = {'onset_env': onset_env, 'onsets_raw': onsets_raw, 'rms': rms, 'onset_backtrack': onset_backtrack,
+                'f0': f0, 'voiced_flag': voiced_flag, 'voiced_prob': voiced_prob}
+
+    prob = timer.run('calc_probabilities', n_frames, notes_p._calc_emission, features, notes_p.minimum_note,
+                     notes_p.max_note, notes_p.pitch_acc, notes_p.voiced_acc, notes_p.onset_acc, notes_p.spread)
+    f0_ = np.round(librosa.hz_to_midi(f0 - librosa.pitch_tuning(f0))).astype(int)
+    loop_prob = timer.run('calc_probabilities_loop', n_frames, reference_emission, f0_, voiced_flag, onset_backtrack,
+                          librosa.note_to_midi(notes_p.minimum_note), notes_p.model_notes(), notes_p.pitch_acc,
+                          notes_p.voiced_acc, notes_p.onset_acc, notes_p.spread)
+    timer.run('build_transition_matrix', n_frames, notes_p._build_transition_matrix, notes_p.minimum_note,
+              notes_p.max_note, notes_p.p_stay_note, notes_p.p_stay_silence)
+    states = timer.run('viterbi', n_frames, notes_p._decode, prob, notes_p.minimum_note, notes_p.max_note,
+                       notes_p.p_stay_note, notes_p.p_stay_silence)
+    piano_format = timer.run('convert_states_to_pianoroll', n_frames, notes_p._convert_states_to_pianoroll, states,
+                             notes_p.minimum_note, notes_p.max_note, hop / sr)
+
+    # the same, decoding only the range of notes the take uses (NotesProcess.adaptive_range)
+    notes_p.adaptive_range = True
+    adaptive_prob = timer.run('calc_probabilities_adaptive', n_frames, notes_p._calc_emission, features,
+                              notes_p.minimum_note, notes_p.max_note, notes_p.pitch_acc, notes_p.voiced_acc,
+                              notes_p.onset_acc, notes_p.spread)
+    adaptive_range = notes_p.states_range
+    adaptive_states = timer.run('viterbi_adaptive', n_frames, notes_p._decode, adaptive_prob, *adaptive_range,
+                                notes_p.p_stay_note, notes_p.p_stay_silence, False, notes_p.model_notes())
+    adaptive_piano = notes_p.piano_roll(sr, adaptive_states, adaptive_range)
+    notes_p.adaptive_range = False
+
+    with tempfile.TemporaryDirectory() as tmp:
+        midi_path = os.path.join(tmp, 'bench.mid')
+        timer.run('midi', n_frames, notes_p.toMidi, y, sr, piano_format, path=midi_path)
+
+        def end_to_end():
+            notes_p.process(y, sr)
+            piano = notes_p.piano_roll(sr)
+            notes_p.toMidi(y, sr, piano, path=midi_path)
+
+        timer.run('end_to_end', n_frames, end_to_end)
+
+    duration = len(y) / sr
+    return {'input': name, 'duration': duration, 'frames': n_frames, 'notes': len(piano_format),
+            'emission_matches_loop': bool(np.array_equal(prob, loop_prob)),
+            'adaptive_range': list(adaptive_range),
+            'adaptive_same_notes': bool(np.array_equal(adaptive_piano, piano_format)),
+            'real_time_factor': timer.stages['end_to_end']['seconds'] / duration,
+            'stages': timer.stages}
+
+
+def _import_probe(module):
+    # runs in a fresh interpreter: import time and the heavy modules it pulled in
+    return ('import json, sys, time\n'
+            'start = time.perf_counter()\n'
+            'import {}\n'
+            'seconds = time.perf_counter() - start\n'
+            'heavy = [m for m in {!r} if m in sys.modules]\n'
+            'print(json.dumps({{"seconds": seconds, "heavy_modules": heavy}}))').format(module, HEAVY_MODULES)
+
+
+def bench_imports(repeat=1):
+    # startup cost of each module and command line entry point, in fresh interpreters
+    here = os.path.dirname(os.path.abspath(__file__))
+    results = []
+    for module in IMPORT_MODULES:
+        best = None
+        for _ in range(repeat):
+            run = subprocess.run([sys.executable, '-c', _import_probe(module)], cwd=here, capture_output=True, text=True)
+            if run.returncode != 0:
+                best = {'error': run.stderr.strip().splitlines()[-1]}
+                break
+            probe = json.loads(run.stdout.strip().splitlines()[-1])
+            if best is None or probe['seconds'] < best['seconds']:
+                best = probe
+        results.append(dict(best, target='import ' + module))
+
+    for command in CLI_COMMANDS:
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            run = subprocess.run([sys.executable] + command, cwd=here, capture_output=True)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        result = {'target': ' '.join(command), 'seconds': best}
+        if run.returncode != 0:
+            result['error'] = run.stderr.decode(errors='replace').strip().splitlines()[-1:]
+        results.append(result)
+    return results
+
+
+def bench_pyin_segments(name, y, sr, segment_counts, repeat=1):
+    # parallel pyin (pitch.pyin_parallel) against single-pass pyin on the same signal
+    from concurrent.futures import ProcessPoolExecutor
+    from pitch import DEFAULT_OVERLAP_SECONDS, pyin_parallel
+
+    notes_p = NotesProcess()
+    fmin = librosa.note_to_hz(notes_p.minimum_note) * 0.9
+    fmax = librosa.note_to_hz(notes_p.max_note) * 1.1
+    args = (fmin, fmax, notes_p.frame_length, notes_p.window_length, notes_p.hop_length)
+
+    timer = StageTimer(repeat)
+    f0, voiced_flag, voiced_prob = timer.run('single', None, pyin_parallel, y, sr, *args, 1)
+    single = timer.stages['single']['seconds']
+
+    runs = []
+    with ProcessPoolExecutor(max_workers=max(segment_counts)) as pool:
+        # workers start (and import librosa) before anything is timed
+        list(pool.map(abs, range(max(segment_counts))))
+        for n in segment_counts:
+            key = 'segments-{}'.format(n)
+            seg_f0, seg_flag, seg_prob = timer.run(key, None, pyin_parallel, y, sr, *args, n, executor=pool)
+            both = voiced_flag & seg_flag
+            runs.append({'segments': n, 'seconds': timer.stages[key]['seconds'],
+                         'speedup': single / timer.stages[key]['seconds'],
+                         'voiced_flag_differences': int(np.sum(seg_flag != voiced_flag)),
+                         'f0_differences': int(np.sum(seg_f0[both] != f0[both])),
+                         'voiced_prob_max_difference': float(np.max(np.abs(seg_prob - voiced_prob)))})
+    return {'input': name, 'duration': len(y) / sr, 'frames': len(f0), 'overlap_seconds': DEFAULT_OVERLAP_SECONDS,
+            'cpus': os.cpu_count(), 'single_seconds': single, 'runs': runs}
+
+
+def bench_pitch_backends(name, y, sr, backends, repeat=1):
+    # F0 backends (pitch.PITCH_BACKENDS) through the whole transcription; notes
+    # of each backend are scored against those of the first one (pyin)
+    from evaluation import match_onsets, onset_scores
+    from profiling import Profiler
+
+    runs = []
+    reference = None
+    for backend in backends:
+        notes_p = NotesProcess()
+        notes_p.pitch_backend = backend
+        notes_p.profiler = Profiler()
+        pitch_seconds = total_seconds = None
+        for _ in range(repeat):
+            notes_p.process(y, sr)
+            report = notes_p.profiler.last_report
+            seconds = sum(s.seconds for s in report.stages if s.name == 'pyin')
+            pitch_seconds = seconds if pitch_seconds is None else min(pitch_seconds, seconds)
+            total_seconds = report.total_seconds if total_seconds is None else min(total_seconds, report.total_seconds)
+        piano_format = notes_p.piano_roll(sr)
+        run = {'backend': backend, 'pitch_seconds': pitch_seconds, 'seconds': total_seconds,
+               'real_time_factor': total_seconds / (len(y) / sr), 'n_notes': len(piano_format)}
+        if reference is None:
+            reference = piano_format
+        else:
+            # onset and pitch agreement with the reference transcription
+            run['speedup'] = runs[0]['pitch_seconds'] / pitch_seconds
+            run.update({'onset_' + k: v for k, v in onset_scores(piano_format['onset'], reference['onset']).items()})
+            pairs = match_onsets(piano_format['onset'], reference['onset'])
+            estimated_midi = piano_format['midi'][np.argsort(piano_format['onset'], kind='stable')]
+            reference_midi = reference['midi'][np.argsort(reference['onset'], kind='stable')]
+            same = [estimated_midi[i] == reference_midi[j] for i, j in pairs]
+            run['pitch_accuracy'] = float(np.mean(same)) if same else None
+        runs.append(run)
+    return {'input': name, 'duration': len(y) / sr, 'runs': runs}
+
+
+def bench_decode_batch(name, y, sr, chunk_seconds, repeat=1):
+    # many short sequences (chunks of y, like CapAudio's 2-bar chunks): one
+    # Viterbi call per chunk against NoteViterbi.decode_batch over all of them
+    notes_p = NotesProcess()
+    chunk = int(chunk_seconds * sr)
+    probs = []
+    for start in range(0, len(y), chunk):
+        probs.append(notes_p._calc_probabilities(y[start:start + chunk], notes_p.minimum_note, notes_p.max_note, sr,
+                                                 notes_p.frame_length, notes_p.window_length, notes_p.hop_length,
+                                                 notes_p.pitch_acc, notes_p.voiced_acc, notes_p.onset_acc,
+                                                 notes_p.spread, compact=True))
+    args = (notes_p.minimum_note, notes_p.max_note, notes_p.p_stay_note, notes_p.p_stay_silence)
+
+    timer = StageTimer(repeat)
+    sequential = timer.run('sequential', None, lambda: [notes_p._decode(prob, *args) for prob in probs])
+    batched = timer.run('batched', None, notes_p._decode_batch, probs, *args)
+    return {'input': name, 'duration': len(y) / sr, 'chunk_seconds': chunk_seconds, 'chunks': len(probs),
+            'sequential_seconds': timer.stages['sequential']['seconds'],
+            'batched_seconds': timer.stages['batched']['seconds'],
+            'speedup': timer.stages['sequential']['seconds'] / timer.stages['batched']['seconds'],
+            'identical': all(np.array_equal(a, b) for a, b in zip(sequential, batched))}
+
+
+def compare(old_path, new_results):
+    with open(old_path) as f:
+        old = {r['input']: r for r in json.load(f)['results'] if 'stages' in r}
+    for result in new_results:
+        if result['input'] not in old or 'stages' not in result:
+            continue
+        print(result['input'])
+        for stage, values in result['stages'].items():
+            before = old[result['input']]['stages'].get(stage)
+            if before is None or not values['seconds']:
+                continue
+            print('  {:<30} {:>9.4f}s -> {:>9.4f}s  x{:.2f}'.format(
+                stage, before['seconds'], values['seconds'], before['seconds'] / values['seconds']))
+
+
+def write_report(path, **sections):
+    report = {'date': datetime.datetime.now().isoformat(timespec='seconds'), 'python': sys.version.split()[0],
+              'platform': platform.platform()}
+    report.update(sections)
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=2)
+
+
+def run_inputs(jobs, bench, show):
+    # bench(name, load) per input; a failure is recorded and the next input goes on
+    results = []
+    for name, load in jobs:
+        try:
+            result = bench(name, load)
+        except Exception as e:
+            result = {'input': name, 'error': type(e).__name__ + ': ' + str(e)}
+            print('{}: {}'.format(name, result['error']))
+        else:
+            show(result)
+        results.append(result)
+    return results
+
+
+def _show_signal(result):
+    print('{}: {:.1f}s of audio, end to end {:.2f}s (RTF {:.3f})'.format(
+        result['input'], result['duration'], result['stages']['end_to_end']['seconds'], result['real_time_factor']))
+
+
+def _show_pyin_segments(result):
+    print('{}: {:.1f}s of audio, single pass {:.2f}s'.format(result['input'], result['duration'],
+                                                            result['single_seconds']))
+    for run in result['runs']:
+        print('  {segments:>3} segments {seconds:>7.2f}s  x{speedup:.2f}  voiced_flag differs in '
+              '{voiced_flag_differences} frames, f0 in {f0_differences}'.format(**run))
+
+
+def _show_decode_batch(result):
+    print('{input}: {chunks} chunks of {chunk_seconds:g}s, sequential {sequential_seconds:.3f}s, '
+          'batched {batched_seconds:.3f}s  x{speedup:.1f}  identical {identical}'.format(**result))
+
+
+def _show_pitch_backends(result):
+    print('{}: {:.1f}s of audio'.format(result['input'], result['duration']))
+    for run in result['runs']:
+        line = '  {backend:<6} F0 {pitch_seconds:>7.3f}s  total {seconds:>7.3f}s  {n_notes} notes'.format(**run)
+        if 'speedup' in run:
+            line += '  x{speedup:.1f}  onsets F {onset_f_measure:.3f}'.format(**run)
+            if run['pitch_accuracy'] is not None:
+                line += '  pitch {pitch_accuracy:.3f}'.format(**run)
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the NotesProcess pipeline stage by stage.')
+    parser.add_argument('inputs', nargs='*', help='audio files (default: the bundled recordings)')
+    parser.add_argument('--sweeps', type=float, nargs='*', default=DEFAULT_SWEEPS,
+                        help='durations in seconds of synthetic pitch sweeps')
+    parser.add_argument('--repeat', type=int, default=1, help='runs per stage, the fastest is kept')
+    parser.add_argument('-o', '--output', default='benchmark.json', help='JSON results file')
+    parser.add_argument('--compare', help='previous JSON results to compare against')
+    parser.add_argument('--imports', action='store_true',
+                        help='only measure import and command line startup times')
+    parser.add_argument('--pyin-segments', type=int, nargs='+', metavar='N',
+                        help='only compare parallel pyin with N segments against single-pass pyin')
+    parser.add_argument('--decode-batch', type=float, nargs='+', metavar='SECONDS',
+                        help='only compare per-chunk Viterbi calls with one batched call, for chunks of SECONDS')
+    parser.add_argument('--pitch-backends', nargs='+', metavar='NAME',
+                        help='only compare F0 backends (e.g. pyin yin); the first one is the reference')
+    args = parser.parse_args()
+
+    if args.imports:
+        imports = bench_imports(args.repeat)
+        for result in imports:
+            print('{:<40} {:>7.3f}s  {}'.format(result['target'], result.get('seconds') or 0.0,
+                                               result.get('error') or ', '.join(result.get('heavy_modules', []))))
+        write_report(args.output, imports=imports)
+        return
+
+    inputs = args.inputs or [path for path in DEFAULT_INPUTS if os.path.exists(path)]
+    jobs = [(path, lambda path=path: librosa.load(path)) for path in inputs]
+    jobs += [('sweep-{:g}s'.format(d), lambda d=d: synthetic_sweep(d)) for d in args.sweeps]
+
+    if args.pyin_segments:
+        results = run_inputs(jobs, lambda name, load: bench_pyin_segments(name, *load(), args.pyin_segments,
+                                                                          args.repeat), _show_pyin_segments)
+        write_report(args.output, pyin_segments=results)
+        return
+
+    if args.decode_batch:
+        results = []
+        for chunk_seconds in args.decode_batch:
+            results += run_inputs(jobs, lambda name, load: bench_decode_batch(name, *load(), chunk_seconds,
+                                                                              args.repeat), _show_decode_batch)
+        write_report(args.output, decode_batch=results)
+        return
+
+    if args.pitch_backends:
+        results = run_inputs(jobs, lambda name, load: bench_pitch_backends(name, *load(), args.pitch_backends,
+                                                                           args.repeat), _show_pitch_backends)
+        write_report(args.output, pitch_backends=results)
+        return
+
+    results = run_inputs(jobs, lambda name, load: bench_signal(name, load, args.repeat), _show_signal)
+    write_report(args.output, numpy=np.__version__, librosa=librosa.__version__, repeat=args.repeat,
+                 results=results)
+
+    if args.compare:
+        compare(args.compare, results)
+
+if __name__ == '__main__':
+    main()
@@ -1,12 +1,12 @@
-import sounddevice as sd
-import numpy as np
-import notes_process as pn
-import time
-import os
+import argparse
+
+from profiling import Profiler
+from ring_buffer import RingBuffer
 import threading
 
 class CapAudio:
-    def __init__(self):
+    def __init__(self, streaming=False, lag=0.25, on_note=None, profile=False, midi_path=None,
+                 pitch_backend='pyin', voicing_threshold=None, pipelined=False, workers=None, queue_size=2):
         self.figureOfTime = 1
         self.beats = 4
         self.going = 60
@@ -17,8 +17,21 @@ class CapAudio:
         self.samplerate = None
         self.blocksize = None
         self.latency = None
-        self.data = []
-        self.stop = False
+        self.data = None
+        self.streaming = streaming
+        self.lag = lag
+        self.profile = profile
+        self.midi_path = midi_path
+        self.pitch_backend = pitch_backend
+        self.voicing_threshold = voicing_threshold
+        self.pipelined = pipelined
+        self.workers = workers
+        self.queue_size = queue_size
+        self.on_note = on_note if on_note is not None else print
+        self.xruns = 0
+        self.behind = 0
+        self.max_backlog = 0
+        self.errors = 0
 
         self.load_config()
 
@@ -28,31 +41,147 @@ class CapAudio:
         self.windowPerBeat = self.beatTime / self.windowSize
         self.windowPerCompasse = self.beats * self.windowPerBeat
 
+        # room for 4 times the 2-compass processing window
+        self.data = RingBuffer(4 * 2 * int(self.windowPerCompasse) * self.blocksize)
+
     def load_config(self):
         with open('config.env', 'r') as file:
             for line in file:
                 key, value = line.strip().split('=')
                 setattr(self, key.strip(), int(value.strip()))
 
+    def pitch_options(self):
+        # the voicing threshold only exists for yin; pyin takes no options
+        if self.pitch_backend == 'yin' and self.voicing_threshold is not None:
+            return {'threshold': self.voicing_threshold}
+        return {}
+
+    def configure(self, notes_p):
+        notes_p.pitch_backend = self.pitch_backend
+        notes_p.pitch_options = self.pitch_options()
+
     def process_audio(self):
         print("Processando áudio")
-        
-        while not self.stop:
-            if len(self.data) >= 2 * self.windowPerCompasse:
-                print("tratando")
-                rec = np.array((len(self.data) * self.samplerate,))
-                rec = np.concatenate(np.squeeze(np.stack(self.data)))
-                del self.data[:]
-                notes_piano_formart = pn.NotesProcess().getNotesPianoFormart(y=rec, sr=self.samplerate)
+        midi = None
+        if self.midi_path is not None:
+            from midi_writer import MidiWriter
+            # notes are written as they are found; the session has no global tempo, the configured one is used
+            midi = MidiWriter(self.midi_path, bpm=self.going)
+
+        try:
+            if self.streaming:
+                self.process_audio_streaming(midi)
+            elif self.pipelined:
+                self.process_audio_pipelined(midi)
+            else:
+                self.process_audio_chunks(midi)
+        finally:
+            if midi is not None:
+                midi.close()
+                print(f'{midi.n_notes} notas gravadas em {self.midi_path}')
+
+    def process_audio_chunks(self, midi=None):
+        import notes_process as pn
+
+        chunk = 2 * int(self.windowPerCompasse) * self.blocksize
+        chunk_start = 0.0
+        index = 0
+        # sleeps until the callback has written a whole chunk; returns False once capture stopped
+        while self.data.wait_for(chunk):
+            print("tratando")
+            rec = self.data.peek(chunk).astype(float)
+            self.data.advance(chunk)
+            # a failing chunk is reported and skipped: the ring must keep draining (see pipeline.LivePipeline)
+            try:
+                notes_p = pn.NotesProcess()
+                self.configure(notes_p)
+                if self.profile:
+                    notes_p.profiler = Profiler(callback=self.log_report)
+                if midi is None:
+                    notes_piano_formart = notes_p.getNotesPianoFormart(y=rec, sr=self.samplerate)
+                else:
+                    notes_piano_formart = notes_p.getNotesPianoFormart(y=rec, sr=self.samplerate, midi_path=None)
+                    midi.add_notes(notes_piano_formart, time_offset=chunk_start)
                 # print([[lista[3]] for lista in notes_piano_formart])
                 print(notes_piano_formart)
+            except Exception as e:
+                self.errors += 1
+                print('trecho {} falhou: {}'.format(index, type(e).__name__ + ': ' + str(e)))
+            index += 1
+            chunk_start += chunk / self.samplerate
+            self.check_backpressure(chunk)
+
+    def process_audio_pipelined(self, midi=None):
+        # same chunks as process_audio_chunks, analysed and decoded in worker
+        # processes (see pipeline.LivePipeline) while the next ones are captured
+        from pipeline import LivePipeline
+
+        def output(notes_piano_formart, chunk_start):
+            if midi is not None:
+                midi.add_notes(notes_piano_formart, time_offset=chunk_start)
+            print(notes_piano_formart)
+
+        chunk = 2 * int(self.windowPerCompasse) * self.blocksize
+        chunk_start = 0.0
+        # a chunk should come out before the next bar is over
+        with LivePipeline(output, feature_workers=self.workers, queue_size=self.queue_size,
+                          pitch_backend=self.pitch_backend, pitch_options=self.pitch_options(), budget=self.compassTime,
+                          report=self.log_report if self.profile else None) as pipeline:
+            while self.data.wait_for(chunk):
+                rec = self.data.peek(chunk).astype(float)
+                self.data.advance(chunk)
+                # blocks while the features queue is full; the ring buffer keeps capturing meanwhile
+                pipeline.put(rec, self.samplerate, chunk_start)
+                chunk_start += chunk / self.samplerate
+                self.check_backpressure(chunk)
+        print(f'pipeline: {pipeline.summary()}, {pipeline.late} trechos acima de {self.compassTime:.2f}s')
+
+    def process_audio_streaming(self, midi=None):
+        # keeps the HMM state between chunks and emits each note `lag` seconds after it ends
+        from streaming import StreamingTranscriber
+
+        on_note = self.on_note
+        if midi is not None:
+            def on_note(note):
+                midi.add_note(note['onset'], note['offset'], note['midi'])
+                self.on_note(note)
+
+        transcriber = StreamingTranscriber(self.samplerate, lag=self.lag, callback=on_note)
+        self.configure(transcriber.notes_p)
+        if self.profile:
+            transcriber.notes_p.profiler = Profiler(callback=self.log_report)
+        chunk = max(1, int(self.windowPerBeat)) * self.blocksize
+
+        while self.data.wait_for(chunk):
+            transcriber.push(self.data.peek(chunk) / 32768.0)
+            self.data.advance(chunk)
+            self.check_backpressure(chunk)
+
+        transcriber.push(self.data.read() / 32768.0)
+        transcriber.flush()
+
+    def log_report(self, report):
+        # one line per processed chunk; RTF > 1 means this chunk took longer than its audio
+        print(f'[perfil] {report}')
+
+    def check_backpressure(self, chunk):
+        # more than one chunk still queued after processing one: we are falling behind capture
+        backlog = self.data.available()
+        self.max_backlog = max(self.max_backlog, backlog)
+        if backlog >= chunk:
+            self.behind += 1
+            print(f'processamento atrasado: {backlog / self.samplerate:.2f}s na fila '
+                  f'({100 * backlog / self.data.capacity:.0f}% do buffer)')
 
     def callback(self, indata, frames, time, status):
+        # runs on the PortAudio thread: no printing and no allocation here
         if status:
-            print(status)
-        self.data.append(np.frombuffer(indata, dtype=np.int16).astype(float))
+            self.xruns += 1
+        self.data.write(indata[:, 0])
 
     def capture_audio(self):
+        import sounddevice as sd
+
         try:
             with sd.InputStream(device=self.input_device,
                                samplerate=self.samplerate,
@@ -72,6 +201,7 @@ class CapAudio:
             exit()
 
         print('Fim da gravação...')
+        print(f'xruns {self.xruns}, overruns {self.data.overruns} ({self.data.dropped} amostras perdidas)')
 
     def start_processing(self):
         thread_audio = threading.Thread(target=self.capture_audio)
@@ -81,9 +211,30 @@ class CapAudio:
         thread_process.start()
 
         thread_audio.join()
-        self.stop = True
+        self.data.close()
         thread_process.join()
+        print(f'chunks atrasados {self.behind}, maior fila {self.max_backlog / self.samplerate:.2f}s, '
+              f'chunks com erro {self.errors}')
 
 if __name__ == '__main__':
-    c_audio = CapAudio()
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--streaming', action='store_true', help='incremental transcription with a fixed lag')
+    parser.add_argument('--lag', type=float, default=0.25, help='decoding lag in seconds (streaming mode)')
+    parser.add_argument('--profile', action='store_true', help='log stage timings and real-time factor per chunk')
+    parser.add_argument('--midi', help='write the notes to this .mid file while capturing')
+    parser.add_argument('--pitch-backend', choices=['pyin', 'yin'], default='pyin',
+                        help="F0 tracker: 'yin' is much faster and meant for live use (default pyin)")
+    parser.add_argument('--voicing-threshold', type=float,
+                        help='yin voicing threshold on the normalized difference (default 0.2)')
+    parser.add_argument('--pipelined', action='store_true',
+                        help='analyse and decode chunks in worker processes while capturing')
+    parser.add_argument('--workers', type=int, help='feature worker processes (pipelined mode, default CPUs - 1)')
+    parser.add_argument('--queue-size', type=int, default=2, help='chunks waiting between stages (pipelined mode)')
+    args = parser.parse_args()
+    if args.voicing_threshold is not None and args.pitch_backend != 'yin':
+        parser.error('--voicing-threshold needs --pitch-backend yin')
+
+    c_audio = CapAudio(streaming=args.streaming, lag=args.lag, profile=args.profile, midi_path=args.midi,
+                       pitch_backend=args.pitch_backend, voicing_threshold=args.voicing_threshold,
+                       pipelined=args.pipelined, workers=args.workers, queue_size=args.queue_size)
     c_audio.start_processing()
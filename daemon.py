@@ -0,0 +1,223 @@
+import argparse
+import json
+import os
+import signal
+import socket
+import socketserver
+import struct
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+import numpy as np
+
+import pool_worker
+
+DEFAULT_SOCKET = '/tmp/notes_process.sock'
+
+# Protocol, both directions: 4-byte big-endian length of a JSON header,
+# the header, then header['size'] bytes of payload (PCM samples or MIDI).
+#
+# requests:  {'command': 'ping'}
+#            {'command': 'transcribe', 'path': ..., 'midi': bool}
+#            {'command': 'transcribe', 'sr': ..., 'dtype': 'float32', 'size': n, 'midi': bool} + samples
+# responses: {'notes': [[onset, offset, midi, name], ...], 'duration': ..., 'seconds': ..., 'size': n} + MIDI bytes
+#            {'error': ...}
+
+
+def _send(sock, header, payload=b''):
+    header = dict(header, size=len(payload))
+    data = json.dumps(header).encode()
+    sock.sendall(struct.pack('>I', len(data)) + data + payload)
+
+
+def _recv_exactly(sock, n):
+    chunks = []
+    while n:
+        chunk = sock.recv(min(n, 1 << 20))
+        if not chunk:
+            raise ConnectionError('connection closed')
+        chunks.append(chunk)
+        n -= len(chunk)
+    return b''.join(chunks)
+
+
+def _recv(sock):
+    length = struct.unpack('>I', _recv_exactly(sock, 4))[0]
+    header = json.loads(_recv_exactly(sock, length))
+    return header, _recv_exactly(sock, header.get('size', 0))
+
+
+def _transcribe(path, samples, dtype, sr, want_midi):
+    import librosa
+    start = time.perf_counter()
+    if path is not None:
+        y, sr = librosa.load(path)
+    else:
+        y = np.frombuffer(samples, dtype=dtype).astype(np.float32)
+    notes_p = pool_worker.notes_process()
+    notes_p.process(y, sr)
+    piano_format = notes_p.piano_roll(sr)
+    names = notes_p._note_names(notes_p.minimum_note, notes_p.max_note)
+    notes = [[float(n['onset']), float(n['offset']), int(n['midi']), names[n['name']]] for n in piano_format]
+
+    midi = notes_p._convert_pianoroll_to_midi(y, sr, piano_format) if want_midi else b''
+    return {'notes': notes, 'duration': len(y) / sr, 'seconds': time.perf_counter() - start}, midi
+
+
+class _Handler(socketserver.BaseRequestHandler):
+
+    def handle(self):
+        # one connection can carry several requests
+        while True:
+            try:
+                header, payload = _recv(self.request)
+            except (ConnectionError, struct.error):
+                return
+            except (ValueError, UnicodeDecodeError) as e:
+                # malformed header (JSONDecodeError is a ValueError): answer once and drop the connection
+                _send(self.request, {'error': 'bad request: ' + type(e).__name__ + ': ' + str(e)})
+                return
+            try:
+                response, data = self.server.dispatch(header, payload)
+            except Exception as e:
+                response, data = {'error': type(e).__name__ + ': ' + str(e)}, b''
+            _send(self.request, response, data)
+
+
+class TranscriptionServer(socketserver.ThreadingUnixStreamServer):
+    # Keeps `workers` warmed NotesProcess instances in a process pool; each
+    # client connection is served by a thread that hands the audio to the pool.
+    daemon_threads = True
+
+    def __init__(self, socket_path=DEFAULT_SOCKET, workers=None, cache_dir=None, warm_up=True):
+        if os.path.exists(socket_path):
+            # a stale file from a crashed daemon is replaced, a live daemon's socket is not
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(socket_path)
+            except OSError:
+                os.unlink(socket_path)
+            else:
+                raise RuntimeError('{} is in use by a running daemon'.format(socket_path))
+            finally:
+                probe.close()
+        self.workers = workers or os.cpu_count()
+        # a warmed NotesProcess per worker: librosa imported and numba compiled before the first request
+        self.pool = ProcessPoolExecutor(max_workers=self.workers,
+                                        initializer=partial(pool_worker.init_worker, cache_dir, warm_up))
+        pool_worker.start_workers(self.pool, self.workers)
+        super().__init__(socket_path, _Handler)
+
+    def dispatch(self, header, payload):
+        command = header.get('command')
+        if command == 'ping':
+            return {'ok': True}, b''
+        if command != 'transcribe':
+            raise ValueError('unknown command {!r}'.format(command))
+        if header.get('path') is None and 'sr' not in header:
+            raise ValueError('transcribe needs a path or sr + samples')
+        future = self.pool.submit(_transcribe, header.get('path'), payload, header.get('dtype', 'float32'),
+                                  header.get('sr'), header.get('midi', False))
+        return future.result()
+
+    def server_close(self):
+        super().server_close()
+        if os.path.exists(self.server_address):
+            os.unlink(self.server_address)
+        self.pool.shutdown()
+
+
+class TranscriptionClient():
+
+    def __init__(self, socket_path=DEFAULT_SOCKET, timeout=None):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(timeout)
+        self.sock.connect(socket_path)
+
+    def _request(self, header, payload=b''):
+        _send(self.sock, header, payload)
+        response, data = _recv(self.sock)
+        if 'error' in response:
+            raise RuntimeError(response['error'])
+        return response, data
+
+    def ping(self):
+        return self._request({'command': 'ping'})[0].get('ok', False)
+
+    def transcribe_file(self, path, midi=False):
+        # path is opened by the server
+        return self._request({'command': 'transcribe', 'path': os.path.abspath(path), 'midi': midi})
+
+    def transcribe(self, y, sr, midi=False):
+        y = np.ascontiguousarray(y, dtype=np.float32)
+        return self._request({'command': 'transcribe', 'sr': sr, 'dtype': 'float32', 'midi': midi}, y.tobytes())
+
+    def close(self):
+        self.sock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _terminate(signum, frame):
+    # SIGTERM leaves through the with block too, so the socket file is removed;
+    # a second one (e.g. sent to the whole process group) must not interrupt that
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    sys.exit(0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Warm transcription service over a Unix socket.')
+    parser.add_argument('--socket', default=DEFAULT_SOCKET, help='socket path (default {})'.format(DEFAULT_SOCKET))
+    commands = parser.add_subparsers(dest='command', required=True)
+    serve = commands.add_parser('serve', help='start the service')
+    serve.add_argument('-j', '--jobs', type=int, default=os.cpu_count(), help='worker processes')
+    serve.add_argument('--cache-dir', help='feature cache directory')
+    serve.add_argument('--no-warm-up', action='store_true', help='skip the warm-up transcription of each worker')
+    transcribe = commands.add_parser('transcribe', help='send files to a running service')
+    transcribe.add_argument('inputs', nargs='+', help='audio files')
+    transcribe.add_argument('-o', '--output-dir', help='write one .mid per input here')
+    args = parser.parse_args()
+
+    if args.command == 'serve':
+        try:
+            server = TranscriptionServer(args.socket, args.jobs, args.cache_dir, not args.no_warm_up)
+        except RuntimeError as e:
+            parser.exit(1, 'daemon: {}\n'.format(e))
+        with server:
+            # set after the workers started so they keep the default handler
+            signal.signal(signal.SIGTERM, _terminate)
+            print('listening on {} with {} workers'.format(args.socket, server.workers))
+            try:
+                server.serve_forever()
+            except KeyboardInterrupt:
+                pass
+        return
+
+    failures = 0
+    with TranscriptionClient(args.socket) as client:
+        for path in args.inputs:
+            start = time.perf_counter()
+            try:
+                response, midi = client.transcribe_file(path, midi=args.output_dir is not None)
+            except RuntimeError as e:
+                failures += 1
+                print('FAIL {}: {}'.format(path, e))
+                continue
+            if args.output_dir is not None:
+                os.makedirs(args.output_dir, exist_ok=True)
+                midi_path = os.path.join(args.output_dir, os.path.splitext(os.path.basename(path))[0] + '.mid')
+                with open(midi_path, 'wb') as f:
+                    f.write(midi)
+            print('{}: {} notes, {:.1f}s of audio in {:.3f}s'.format(
+                path, len(response['notes']), response['duration'], time.perf_counter() - start))
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,136 @@
+import argparse
+import struct
+
+import numpy as np
+
+DEFAULT_TOLERANCE = 0.05
+
+
+def match_onsets(estimated, reference, tolerance=DEFAULT_TOLERANCE):
+    # One-to-one matching of onset times (seconds): every reference onset
+    # matches at most one estimated onset within +-tolerance and vice versa.
+    # Going through the estimates in time order and taking the earliest free
+    # reference inside the window gives the largest possible number of matches
+    # for points on a line. Window bounds come from np.searchsorted, so the
+    # cost is O((N + M) log M).
+    # Returns (estimated index, reference index) pairs, both in the sorted order.
+    estimated = np.sort(np.asarray(estimated, dtype=np.float64))
+    reference = np.sort(np.asarray(reference, dtype=np.float64))
+
+    low = np.searchsorted(reference, estimated - tolerance, side='left')
+    high = np.searchsorted(reference, estimated + tolerance, side='right')
+    candidates = np.flatnonzero(low < high)
+
+    pairs = []
+    next_free = 0
+    for i, lo, hi in zip(candidates.tolist(), low[candidates].tolist(), high[candidates].tolist()):
+        j = max(lo, next_free)
+        if j < hi:
+            pairs.append((i, j))
+            next_free = j + 1
+    return pairs
+
+
+def onset_scores(estimated, reference, tolerance=DEFAULT_TOLERANCE):
+    matches = len(match_onsets(estimated, reference, tolerance))
+    n_estimated, n_reference = len(estimated), len(reference)
+    precision = matches / n_estimated if n_estimated else 0.0
+    recall = matches / n_reference if n_reference else 0.0
+    f_measure = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+    return {'matches': matches, 'n_estimated': n_estimated, 'n_reference': n_reference,
+            'precision': precision, 'recall': recall, 'f_measure': f_measure}
+
+
+def _read_varlen(data, pos):
+    value = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value = (value << 7) | (byte & 0x7F)
+        if not byte & 0x80:
+            return value, pos
+
+
+def read_midi_notes(path):
+    # Minimal Standard MIDI File reader for ground truth: returns the
+    # (onset seconds, midi pitch) of every note-on with velocity > 0, sorted by
+    # time, following the tempo changes of all tracks.
+    with open(path, 'rb') as f:
+        data = f.read()
+
+    if data[:4] != b'MThd':
+        raise ValueError('{} is not a MIDI file'.format(path))
+    header_length, _, n_tracks, division = struct.unpack('>IHHH', data[4:14])
+    if division & 0x8000:
+        raise ValueError('SMPTE time division is not supported')
+
+    tempos = [(0, 500000)]   # (tick, microseconds per quarter)
+    notes = []               # (tick, pitch)
+    pos = 8 + header_length
+    for _ in range(n_tracks):
+        if data[pos:pos + 4] != b'MTrk':
+            raise ValueError('bad track chunk in {}'.format(path))
+        length = struct.unpack('>I', data[pos + 4:pos + 8])[0]
+        pos += 8
+        end = pos + length
+        tick = 0
+        status = None
+        while pos < end:
+            delta, pos = _read_varlen(data, pos)
+            tick += delta
+            if data[pos] & 0x80:
+                status = data[pos]
+                pos += 1
+            if status == 0xFF:
+                meta_type = data[pos]
+                size, pos = _read_varlen(data, pos + 1)
+                if meta_type == 0x51:
+                    tempos.append((tick, int.from_bytes(data[pos:pos + 3], 'big')))
+                pos += size
+                status = None
+            elif status in (0xF0, 0xF7):
+                size, pos = _read_varlen(data, pos)
+                pos += size
+                status = None
+            elif status is None:
+                raise ValueError('running status without a previous status byte in {}'.format(path))
+            elif status & 0xF0 in (0xC0, 0xD0):
+                pos += 1
+            else:
+                if status & 0xF0 == 0x90 and data[pos + 1] > 0:
+                    notes.append((tick, data[pos]))
+                pos += 2
+        pos = end
+
+    # ticks -> seconds with the tempo map (a later event at the same tick wins)
+    tempos.sort(key=lambda t: t[0])
+    tempo_ticks = np.array([t[0] for t in tempos])
+    seconds_per_tick = np.array([t[1] for t in tempos]) / 1e6 / division
+    tempo_seconds = np.concatenate(([0.0], np.cumsum(np.diff(tempo_ticks) * seconds_per_tick[:-1])))
+
+    notes.sort()
+    ticks = np.array([n[0] for n in notes], dtype=np.int64)
+    pitches = np.array([n[1] for n in notes], dtype=np.int16)
+    segment = np.searchsorted(tempo_ticks, ticks, side='right') - 1
+    times = tempo_seconds[segment] + (ticks - tempo_ticks[segment]) * seconds_per_tick[segment]
+    return times, pitches
+
+
+def read_midi_onsets(path):
+    return read_midi_notes(path)[0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Score the note onsets of a transcription against a reference MIDI.')
+    parser.add_argument('estimated', help='transcribed .mid')
+    parser.add_argument('reference', help='ground truth .mid')
+    parser.add_argument('-t', '--tolerance', type=float, default=DEFAULT_TOLERANCE, help='seconds (default 0.05)')
+    args = parser.parse_args()
+
+    scores = onset_scores(read_midi_onsets(args.estimated), read_midi_onsets(args.reference), args.tolerance)
+    print('{matches} matches, {n_estimated} estimated, {n_reference} reference: '
+          'P {precision:.3f} R {recall:.3f} F {f_measure:.3f}'.format(**scores))
+
+
+if __name__ == '__main__':
+    main()
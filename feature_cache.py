@@ -0,0 +1,103 @@
+import hashlib
+import os
+import shutil
+import uuid
+
+import numpy as np
+
+
+class FeatureCache():
+    # Persistent cache for the analysis features of NotesProcess (pyin, onsets, rms).
+    # Each entry is a directory of .npy files, so the arrays can be memory mapped on load.
+    # The directory mtime is used as the LRU clock.
+
+    def __init__(self, directory='.feature_cache', max_bytes=512 * 1024 * 1024, mmap=True):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.mmap = mmap
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        os.makedirs(self.directory, exist_ok=True)
+
+    def key(self, y, sr, **params):
+        h = hashlib.sha1()
+        h.update(np.ascontiguousarray(y).view(np.uint8))
+        h.update(str(np.asarray(y).dtype).encode())
+        h.update(repr(('sr', sr)).encode())
+        for name in sorted(params):
+            h.update(repr((name, params[name])).encode())
+        return h.hexdigest()
+
+    def _entry_path(self, key):
+        return os.path.join(self.directory, key)
+
+    def get(self, key):
+        path = self._entry_path(key)
+        if not os.path.isdir(path):
+            self.misses += 1
+            return None
+
+        features = {}
+        try:
+            for file_name in os.listdir(path):
+                name, ext = os.path.splitext(file_name)
+                if ext == '.npy':
+                    features[name] = np.load(os.path.join(path, file_name), mmap_mode='r' if self.mmap else None)
+            os.utime(path)
+        except (OSError, ValueError):
+            # entry removed or truncated by another process
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return features
+
+    def put(self, key, features):
+        path = self._entry_path(key)
+        tmp_path = os.path.join(self.directory, '.tmp-' + uuid.uuid4().hex)
+        os.makedirs(tmp_path)
+        for name, value in features.items():
+            np.save(os.path.join(tmp_path, name + '.npy'), np.asarray(value))
+
+        try:
+            os.replace(tmp_path, path)
+        except OSError:
+            # another writer got there first, keep its entry
+            shutil.rmtree(tmp_path, ignore_errors=True)
+
+        self.evict()
+
+    def _entries(self):
+        entries = []
+        for key in os.listdir(self.directory):
+            path = self._entry_path(key)
+            if key.startswith('.tmp-') or not os.path.isdir(path):
+                continue
+            try:
+                size = sum(os.path.getsize(os.path.join(path, f)) for f in os.listdir(path))
+                entries.append((os.path.getmtime(path), size, path))
+            except OSError:
+                continue
+        return entries
+
+    def size(self):
+        return sum(size for _, size, _ in self._entries())
+
+    def evict(self):
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
+            self.evictions += 1
+
+    def clear(self):
+        for _, _, path in self._entries():
+            shutil.rmtree(path, ignore_errors=True)
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                'entries': len(self._entries()), 'bytes': self.size()}
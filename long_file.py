@@ -0,0 +1,80 @@
+import argparse
+import contextlib
+import csv
+import time
+
+import librosa
+import numpy as np
+
+from midi_writer import MidiWriter
+from notes_process import PIANOROLL_DTYPE, NotesProcess
+from streaming import StreamingTranscriber
+
+
+def transcribe_long(path, block_seconds=30.0, lag=0.25, on_note=None, notes_process=None, keep_notes=True):
+    # Reads the file in blocks of `block_seconds` and feeds them to a StreamingTranscriber,
+    # so memory depends on the block size and not on the length of the recording.
+    # Audio is analysed at the file's native sample rate.
+    sr = librosa.get_samplerate(path)
+    transcriber = StreamingTranscriber(sr, notes_process=notes_process, lag=lag, callback=on_note,
+                                       keep_notes=keep_notes)
+    hop_length = transcriber.hop_length
+    block_length = max(1, int(block_seconds * sr / hop_length))
+
+    # frame_length == hop_length gives contiguous, non-overlapping blocks; the
+    # overlap needed by the analysis is kept inside the transcriber
+    for block in librosa.stream(path, block_length=block_length, frame_length=hop_length, hop_length=hop_length,
+                                mono=True, fill_value=None):
+        transcriber.push(block)
+    transcriber.flush()
+
+    # same layout as NotesProcess._convert_states_to_pianoroll
+    return np.array(transcriber.notes, dtype=PIANOROLL_DTYPE), sr
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Transcribe a long recording block by block with bounded memory.')
+    parser.add_argument('input', help='audio file readable by soundfile (wav, flac, ogg)')
+    parser.add_argument('-o', '--output', help='CSV file the notes are appended to as soon as they end')
+    parser.add_argument('--block-seconds', type=float, default=30.0, help='audio read and analysed per block')
+    parser.add_argument('--lag', type=float, default=0.25, help='decoding lag in seconds')
+    parser.add_argument('--midi', help='.mid file the notes are appended to as soon as they end')
+    parser.add_argument('--bpm', type=float, default=120.0, help='tempo written to the MIDI file')
+    parser.add_argument('--pyin-segments', type=int, default=1, metavar='N',
+                        help='run pyin on N overlapping pieces of every block in parallel')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    notes_p = NotesProcess()
+    notes_p.pyin_segments = args.pyin_segments
+    names = notes_p._note_names(notes_p.minimum_note, notes_p.max_note)
+    with contextlib.ExitStack() as stack:
+        stack.callback(notes_p.close)
+        outputs = []
+        if args.output is not None:
+            output_file = stack.enter_context(open(args.output, 'w', newline=''))
+            writer = csv.writer(output_file)
+            writer.writerow(['onset', 'offset', 'midi', 'note'])
+
+            def write_note(note):
+                writer.writerow(['{:.4f}'.format(note['onset']), '{:.4f}'.format(note['offset']), int(note['midi']),
+                                 names[note['name']]])
+                output_file.flush()
+
+            outputs.append(write_note)
+        if args.midi is not None:
+            midi = stack.enter_context(MidiWriter(args.midi, bpm=args.bpm))
+            outputs.append(lambda note: midi.add_note(note['onset'], note['offset'], note['midi']))
+
+        def on_note(note):
+            for output in outputs:
+                output(note)
+
+        transcribe_long(args.input, args.block_seconds, args.lag, on_note=on_note if outputs else print,
+                        notes_process=notes_p, keep_notes=False)
+
+    print('{:.1f}s'.format(time.perf_counter() - start))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,146 @@
+import heapq
+import io
+import struct
+
+DEFAULT_TICKS_PER_QUARTER = 960
+DEFAULT_VELOCITY = 100
+
+
+def _varlen(value):
+    data = bytearray([value & 0x7F])
+    value >>= 7
+    while value:
+        data.insert(0, 0x80 | (value & 0x7F))
+        value >>= 7
+    return bytes(data)
+
+
+class MidiWriter():
+    # Standard MIDI File writer that serializes notes as they arrive.
+    # Same layout as midiutil.MIDIFile(1): format 1, a tempo track and one note
+    # track, note-offs before note-ons on the same tick, so batch output is
+    # byte-identical to the old midiutil path.
+    #
+    # Notes must come in onset order (as NotesProcess and NoteTracker produce
+    # them); note-offs wait in a small heap until the running tick passes them.
+    # With a seekable file the note track is written in chunks and its length
+    # patched on close; otherwise its bytes are kept until close.
+
+    def __init__(self, file, bpm=120.0, ticks_per_quarter=DEFAULT_TICKS_PER_QUARTER, channel=0,
+                 velocity=DEFAULT_VELOCITY, chunk_size=4096):
+        if isinstance(file, (str, bytes)) or hasattr(file, '__fspath__'):
+            self.file = open(file, 'wb')
+            self._owns_file = True
+        else:
+            self.file = file
+            self._owns_file = False
+        self.bpm = bpm
+        self.quarter_note = 60 / bpm
+        self.ticks_per_quarter = ticks_per_quarter
+        self.channel = channel
+        self.velocity = velocity
+        self.chunk_size = chunk_size
+        self.n_notes = 0
+
+        self._tick = 0            # tick of the last event written
+        self._last_onset = 0
+        self._pending_offs = []   # (tick, order, pitch, velocity)
+        self._buffer = bytearray()
+        self._track_bytes = 0
+        self._closed = False
+
+        tempo = struct.pack('>I', int(60000000 / bpm))[1:]
+        tempo_track = b'\x00\xff\x51\x03' + tempo + b'\x00\xff\x2f\x00'
+        self.file.write(b'MThd' + struct.pack('>IHHH', 6, 1, 2, ticks_per_quarter))
+        self.file.write(b'MTrk' + struct.pack('>I', len(tempo_track)) + tempo_track)
+
+        try:
+            self._seekable = self.file.seekable()
+        except AttributeError:
+            self._seekable = False
+        if self._seekable:
+            self._length_position = self.file.tell() + 4
+            self.file.write(b'MTrk\x00\x00\x00\x00')
+
+    def _event(self, tick, data):
+        self._buffer += _varlen(tick - self._tick) + data
+        self._tick = tick
+
+    def _write_offs(self, until_tick):
+        while self._pending_offs and self._pending_offs[0][0] <= until_tick:
+            tick, _, pitch, velocity = heapq.heappop(self._pending_offs)
+            self._event(tick, bytes((0x80 | self.channel, pitch, velocity)))
+
+    def add_note(self, onset, offset, midi, velocity=None):
+        # onset and offset in seconds
+        if self._closed:
+            raise ValueError('MidiWriter is closed')
+        onset_beats = onset / self.quarter_note
+        duration_beats = offset / self.quarter_note - onset_beats
+        on_tick = int(onset_beats * self.ticks_per_quarter)
+        off_tick = on_tick + int(duration_beats * self.ticks_per_quarter)
+        if on_tick < self._last_onset:
+            raise ValueError('notes must be added in onset order ({:.3f}s after {:.3f}s)'.format(
+                onset, self._last_onset * self.quarter_note / self.ticks_per_quarter))
+        velocity = self.velocity if velocity is None else velocity
+
+        # note-offs up to and including this tick go first
+        self._write_offs(on_tick)
+        self._event(on_tick, bytes((0x90 | self.channel, int(midi), velocity)))
+        heapq.heappush(self._pending_offs, (off_tick, self.n_notes, int(midi), velocity))
+        self._last_onset = on_tick
+        self.n_notes += 1
+
+        if self._seekable and len(self._buffer) >= self.chunk_size:
+            self.flush()
+
+    def add_notes(self, piano_format, time_offset=0.0):
+        # piano_format: NotesProcess._convert_states_to_pianoroll output
+        for onset, offset, midi in zip(piano_format['onset'], piano_format['offset'], piano_format['midi']):
+            self.add_note(onset + time_offset, offset + time_offset, midi)
+
+    def flush(self):
+        # completed events go to the file; only possible once the track length can be patched later
+        if self._seekable and self._buffer:
+            self.file.write(self._buffer)
+            self._track_bytes += len(self._buffer)
+            self._buffer = bytearray()
+            self.file.flush()
+
+    def close(self):
+        if self._closed:
+            return
+        self._write_offs(float('inf'))
+        self._event(self._tick, b'\xff\x2f\x00')
+        self._closed = True
+
+        if self._seekable:
+            self.flush()
+            end = self.file.tell()
+            self.file.seek(self._length_position)
+            self.file.write(struct.pack('>I', self._track_bytes))
+            self.file.seek(end)
+        else:
+            self.file.write(b'MTrk' + struct.pack('>I', len(self._buffer)) + self._buffer)
+            self._buffer = bytearray()
+        self.file.flush()
+        if self._owns_file:
+            self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def write_midi(piano_format, file, bpm, **kwargs):
+    # file: path or binary file-like object
+    with MidiWriter(file, bpm, **kwargs) as writer:
+        writer.add_notes(piano_format)
+
+
+def encode_midi(piano_format, bpm, **kwargs):
+    output = io.BytesIO()
+    write_midi(piano_format, output, bpm, **kwargs)
+    return output.getvalue()
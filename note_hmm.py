@@ -0,0 +1,337 @@
+from functools import lru_cache
+
+import numpy as np
+
+# padded frames per decode_batch group: ~30 MB of float64 emissions and back-pointers at 89 states
+DEFAULT_BATCH_FRAMES = 1 << 15
+
+
+class NoteViterbi():
+    # Viterbi decoder specialised for the note HMM of transition_matrix():
+    # State 0 = silencio
+    # States 1, 3, 5... = inicio (onsets)
+    # States 2, 4, 6... = susteim (sustains)
+    #
+    # Every row of that matrix has at most three distinct non-zero values, so
+    # the max over predecessors of each state can be taken from a few shared
+    # terms and one frame costs O(n_notes) instead of O(n_notes^2).
+
+    def __init__(self, n_notes, p_stay_note, p_stay_silence, model_notes=None):
+        self.n_notes = n_notes
+        self.n_states = 2 * n_notes + 1
+        self.p_stay_note = p_stay_note
+        self.p_stay_silence = p_stay_silence
+
+        p_, p__ = transition_probabilities(n_notes, p_stay_note, p_stay_silence, model_notes)
+
+        # log(p + tiny), exactly like librosa.sequence.viterbi
+        self.epsilon = np.finfo(np.float64).tiny
+        self.log_stay_silence = np.log(p_stay_silence + self.epsilon)
+        self.log_silence_to_onset = np.log(p_ + self.epsilon)
+        self.log_leave_sustain = np.log(p__ + self.epsilon)
+        self.log_onset_to_sustain = np.log(1 + self.epsilon)
+        self.log_stay_note = np.log(p_stay_note + self.epsilon)
+
+        self._sustain_index = np.arange(2, self.n_states, 2)
+        self._onset_index = np.arange(1, self.n_states, 2)
+
+    def initial_value(self, log_prob, p_init=None):
+        if p_init is None:
+            p_init = np.zeros(self.n_states)
+            p_init[0] = 1
+        return log_prob + np.log(p_init + self.epsilon)
+
+    def step(self, value, log_prob):
+        # value: scores of every state at t-1, log_prob: log emission at t.
+        # Returns the scores at t and the best predecessor of every state.
+        new_value = np.empty(self.n_states)
+        ptr = np.empty(self.n_states, dtype=np.uint16)
+
+        # sustain -> silence and sustain -> onset share the same probability,
+        # so the best sustain is the same candidate for all of them
+        from_sustain = value[2::2] + self.log_leave_sustain
+        k = np.argmax(from_sustain)
+        best_sustain = from_sustain[k]
+
+        # silence: stays, or comes from a sustain
+        from_silence = value[0] + self.log_stay_silence
+        if from_silence >= best_sustain:
+            new_value[0] = from_silence
+            ptr[0] = 0
+        else:
+            new_value[0] = best_sustain
+            ptr[0] = 2 * k + 2
+
+        # onsets: come from silence or from any sustain
+        from_silence = value[0] + self.log_silence_to_onset
+        if from_silence >= best_sustain:
+            new_value[1::2] = from_silence
+            ptr[1::2] = 0
+        else:
+            new_value[1::2] = best_sustain
+            ptr[1::2] = 2 * k + 2
+
+        # sustains: come from their own onset or stay
+        from_onset = value[1::2] + self.log_onset_to_sustain
+        stay = value[2::2] + self.log_stay_note
+        keep_onset = from_onset >= stay
+        new_value[2::2] = np.where(keep_onset, from_onset, stay)
+        ptr[2::2] = np.where(keep_onset, self._onset_index, self._sustain_index)
+
+        new_value += log_prob
+        return new_value, ptr
+
+    def backtrack(self, value, ptr):
+        n_steps = len(ptr)
+        states = np.zeros(n_steps, dtype=np.uint16)
+        states[-1] = np.argmax(value)
+        for t in range(n_steps - 2, -1, -1):
+            states[t] = ptr[t + 1, states[t + 1]]
+        return states
+
+    def decode(self, prob, p_init=None, log_domain=False):
+        # prob: (n_states, n_frames) emission matrix, as in librosa.sequence.viterbi,
+        # or its log (any float dtype) with log_domain=True, used as is,
+        # or a NoteEmission, whose columns are computed one frame at a time.
+        # Scores are accumulated in float64 either way.
+        # A float32 log matrix (NotesProcess log_domain) is rounded before that, so
+        # where two paths score within float32 precision the tie can resolve the
+        # other way than with the float64 logs of a dense or NoteEmission input.
+        if isinstance(prob, NoteEmission):
+            log_prob = prob
+        elif log_domain:
+            log_prob = prob.T
+        else:
+            log_prob = np.log(prob.T + np.finfo(prob.dtype).tiny)
+        n_steps = len(log_prob)
+
+        ptr = np.zeros((n_steps, self.n_states), dtype=np.uint16)
+        value = self.initial_value(log_prob[0], p_init)
+        for t in range(1, n_steps):
+            value, ptr[t] = self.step(value, log_prob[t])
+
+        return self.backtrack(value, ptr)
+
+    def step_batch(self, value, log_prob):
+        # step() for a batch: value (n_sequences, n_states) at t-1, log_prob the
+        # emissions at t. Same operations row by row, so same scores and ties.
+        rows = np.arange(len(value))[:, np.newaxis]
+        new_value = np.empty_like(value)
+        ptr = np.empty(value.shape, dtype=np.uint16)
+
+        from_sustain = value[:, 2::2] + self.log_leave_sustain
+        k = np.argmax(from_sustain, axis=1)[:, np.newaxis]
+        best_sustain = from_sustain[rows, k]
+
+        from_silence = value[:, :1] + self.log_stay_silence
+        keep = from_silence >= best_sustain
+        new_value[:, :1] = np.where(keep, from_silence, best_sustain)
+        ptr[:, :1] = np.where(keep, 0, 2 * k + 2)
+
+        from_silence = value[:, :1] + self.log_silence_to_onset
+        keep = from_silence >= best_sustain
+        new_value[:, 1::2] = np.where(keep, from_silence, best_sustain)
+        ptr[:, 1::2] = np.where(keep, 0, 2 * k + 2)
+
+        from_onset = value[:, 1::2] + self.log_onset_to_sustain
+        stay = value[:, 2::2] + self.log_stay_note
+        keep_onset = from_onset >= stay
+        new_value[:, 2::2] = np.where(keep_onset, from_onset, stay)
+        ptr[:, 2::2] = np.where(keep_onset, self._onset_index, self._sustain_index)
+
+        new_value += log_prob
+        return new_value, ptr
+
+    def decode_batch(self, probs, lengths=None, p_init=None, log_domain=False, max_padded_frames=DEFAULT_BATCH_FRAMES):
+        # Decodes independent sequences together, one vectorised step per frame
+        # for a whole group. probs: a list of anything decode() takes (ragged), or a
+        # padded (n_sequences, n_states, max_frames) array with their lengths.
+        # Returns one state path per sequence, the same as decode() on each.
+        #
+        # A group is padded to its longest sequence (n_states values per frame,
+        # plus back-pointers), so sequences are grouped by length and a group
+        # holds at most max_padded_frames padded frames. A sequence longer than
+        # that is decoded alone with decode(), which keeps a NoteEmission compact.
+        if isinstance(probs, np.ndarray) and probs.ndim == 3:
+            if lengths is None:
+                lengths = [probs.shape[2]] * len(probs)
+            probs = [prob[:, :n] for prob, n in zip(probs, lengths)]
+        lengths = np.array([len(p) if isinstance(p, NoteEmission) else p.shape[1] for p in probs], dtype=int)
+
+        paths = [None] * len(probs)
+        group = []
+        for i in np.argsort(lengths, kind='stable').tolist() + [None]:
+            # sorted by length, so the sequence being added is the longest of the group
+            if group and (i is None or (len(group) + 1) * lengths[i] > max_padded_frames):
+                if len(group) == 1 and lengths[group[0]] > 0:
+                    paths[group[0]] = self.decode(probs[group[0]], p_init, log_domain)
+                else:
+                    decoded = self._decode_group([probs[j] for j in group], lengths[group], p_init, log_domain)
+                    for j, path in zip(group, decoded):
+                        paths[j] = path
+                group = []
+            if i is not None:
+                group.append(i)
+        return paths
+
+    def _decode_group(self, probs, lengths, p_init, log_domain):
+        n_batch, n_steps = len(lengths), max(lengths.max(), 1)
+        # float32 logs stay float32 here; they are added to float64 scores as in decode()
+        float32 = log_domain and all(not isinstance(p, NoteEmission) and p.dtype == np.float32 for p in probs)
+        log_prob = np.zeros((n_steps, n_batch, self.n_states), dtype=np.float32 if float32 else np.float64)
+        for b, prob in enumerate(probs):
+            if isinstance(prob, NoteEmission):
+                log_prob[:lengths[b], b] = prob.log_frames()
+            elif log_domain:
+                log_prob[:lengths[b], b] = prob.T
+            else:
+                log_prob[:lengths[b], b] = np.log(prob.T + np.finfo(prob.dtype).tiny)
+
+        # sequences that ended keep running on padding; their scores are taken at their last frame
+        ptr = np.zeros((n_steps, n_batch, self.n_states), dtype=np.uint16)
+        value = self.initial_value(log_prob[0], p_init)
+        final = value.copy()
+        for t in range(1, n_steps):
+            value, ptr[t] = self.step_batch(value, log_prob[t])
+            ending = lengths == t + 1
+            final[ending] = value[ending]
+
+        states = np.zeros((n_batch, n_steps), dtype=np.uint16)
+        batch = np.arange(n_batch)
+        last = np.maximum(lengths - 1, 0)
+        states[batch, last] = np.argmax(final, axis=1)
+        for t in range(n_steps - 2, -1, -1):
+            active = batch[t < lengths - 1]
+            states[active, t] = ptr[t + 1, active, states[active, t + 1]]
+        return [states[b, :n] for b, n in enumerate(lengths)]
+
+
+class NoteEmission():
+    # Emission model of the note HMM kept in factored form: a frame's column
+    # depends only on voiced_flag, is_onset and the estimated note, so those are
+    # stored per frame (4 bytes) and the (n_states,) log column is built on
+    # demand. Same values as the log of the matrix from NotesProcess._build_emission.
+    #
+    # log_values: log of (unvoiced, voiced, onset, no_onset, same_pitch, next_pitch, other_pitch)
+
+    def __init__(self, voiced_flag, is_onset, note, n_notes, log_values):
+        self.n_notes = n_notes
+        self.n_states = 2 * n_notes + 1
+        self.voiced_flag = np.asarray(voiced_flag, dtype=bool)
+        self.is_onset = np.asarray(is_onset, dtype=bool)
+        # note index (midi - midi_min); anything past a neighbour of the range
+        # (unvoiced frames included) changes nothing, so it fits in int16
+        self.note = np.clip(note, -2, n_notes + 1).astype(np.int16)
+        (self.log_unvoiced, self.log_voiced, self.log_onset, self.log_no_onset,
+         self.log_same_pitch, self.log_next_pitch, self.log_other_pitch) = np.asarray(log_values, dtype=np.float64)
+
+    @property
+    def n_frames(self):
+        return len(self.note)
+
+    @property
+    def shape(self):
+        return self.n_states, self.n_frames
+
+    @property
+    def nbytes(self):
+        return self.voiced_flag.nbytes + self.is_onset.nbytes + self.note.nbytes
+
+    def __len__(self):
+        return self.n_frames
+
+    def __getitem__(self, t):
+        return self.log_column(t)
+
+    def __iter__(self):
+        for t in range(self.n_frames):
+            yield self.log_column(t)
+
+    def log_column(self, t, out=None):
+        if out is None:
+            out = np.empty(self.n_states)
+        out[0] = self.log_voiced if self.voiced_flag[t] else self.log_unvoiced
+        out[1::2] = self.log_onset if self.is_onset[t] else self.log_no_onset
+        out[2::2] = self.log_other_pitch
+
+        note = self.note[t]
+        for row, value in ((note - 1, self.log_next_pitch), (note + 1, self.log_next_pitch), (note, self.log_same_pitch)):
+            if 0 <= row < self.n_notes:
+                out[2 * row + 2] = value
+        return out
+
+    def log_frames(self):
+        # every column at once, as (n_frames, n_states); for batched decoding
+        frames = np.empty((self.n_frames, self.n_states))
+        frames[:, 0] = np.where(self.voiced_flag, self.log_voiced, self.log_unvoiced)
+        frames[:, 1::2] = np.where(self.is_onset, self.log_onset, self.log_no_onset)[:, np.newaxis]
+        frames[:, 2::2] = self.log_other_pitch
+        t = np.arange(self.n_frames)
+        for offset, value in ((-1, self.log_next_pitch), (1, self.log_next_pitch), (0, self.log_same_pitch)):
+            row = self.note + offset
+            valid = (row >= 0) & (row < self.n_notes)
+            frames[t[valid], 2 * row[valid] + 2] = value
+        return frames
+
+    def dense(self):
+        # the full (n_states, n_frames) log matrix, for inspection only
+        return self.log_frames().T
+
+
+def transition_probabilities(n_notes, p_stay_note, p_stay_silence, model_notes=None):
+    # silence -> onset, sustain -> silence/onset
+    # model_notes: size of the note range the probabilities are spread over
+    # (default n_notes); a model over a pruned range keeps those of the full one
+    if model_notes is None:
+        model_notes = n_notes
+    p_ = (1 - p_stay_silence) / model_notes
+    p__ = (1 - p_stay_note) / (model_notes + 1)
+    return p_, p__
+
+
+@lru_cache(maxsize=32)
+def transition_matrix(n_notes, p_stay_note, p_stay_silence, kind='dense', model_notes=None):
+    # Transition matrix of the note HMM, cached by its parameters.
+    # kind: 'dense' (ndarray), 'sparse' (scipy.sparse.csr_matrix) or 'log'
+    # (log(T + tiny), what librosa.sequence.viterbi computes internally).
+    # Cached results are shared, so all of them are read-only (for the sparse
+    # one its data, indices and indptr arrays).
+    if kind == 'sparse':
+        from scipy import sparse
+        matrix = sparse.csr_matrix(transition_matrix(n_notes, p_stay_note, p_stay_silence, model_notes=model_notes))
+        for array in (matrix.data, matrix.indices, matrix.indptr):
+            array.setflags(write=False)
+        return matrix
+
+    if kind == 'log':
+        matrix = np.log(transition_matrix(n_notes, p_stay_note, p_stay_silence, model_notes=model_notes)
+                        + np.finfo(np.float64).tiny)
+        matrix.setflags(write=False)
+        return matrix
+
+    if kind != 'dense':
+        raise ValueError("kind must be 'dense', 'sparse' or 'log', got {!r}".format(kind))
+
+    n_states = 2 * n_notes + 1
+    p_, p__ = transition_probabilities(n_notes, p_stay_note, p_stay_silence, model_notes)
+    onsets = np.arange(1, n_states, 2)
+    sustains = np.arange(2, n_states, 2)
+
+    matrix = np.zeros((n_states, n_states))
+    # State 0: silencio
+    matrix[0, 0] = p_stay_silence
+    matrix[0, onsets] = p_
+    # onsets always go to their own sustain
+    matrix[onsets, onsets + 1] = 1
+    # sustains: silence, any onset, or stay
+    matrix[sustains, 0] = p__
+    matrix[sustains[:, np.newaxis], onsets[np.newaxis, :]] = p__
+    matrix[sustains, sustains] = p_stay_note
+    matrix.setflags(write=False)
+    return matrix
+
+
+@lru_cache(maxsize=32)
+def note_viterbi(n_notes, p_stay_note, p_stay_silence, model_notes=None):
+    # decoders hold no per-call state, so one per parameter set is shared
+    return NoteViterbi(n_notes, p_stay_note, p_stay_silence, model_notes)
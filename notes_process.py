@@ -1,9 +1,24 @@
 import numpy as np
 import librosa
-import midiutil
 import re
-import sounddevice as sd
-import time
+from contextlib import nullcontext
+from functools import lru_cache
+
+from evaluation import onset_scores
+from midi_writer import encode_midi, write_midi
+from note_hmm import NoteEmission, note_viterbi, transition_matrix
+from pitch import get_pitch_backend, pyin_parallel, pyin_pool
+
+_no_profiling = nullcontext()
+
+# one note per row of _convert_states_to_pianoroll, 'name' indexes note_names(midi_min, midi_max)
+PIANOROLL_DTYPE = np.dtype([('onset', np.float64), ('offset', np.float64), ('midi', np.int16), ('name', np.int16)])
+
+
+@lru_cache(maxsize=8)
+def note_names(midi_min, midi_max):
+    return tuple(librosa.midi_to_note(np.arange(midi_min, midi_max + 1)))
+
 
 class NotesProcess():
     
@@ -27,7 +42,26 @@ class NotesProcess():
         self.onset_env = None
         self.states = None
         self.piano_format = None
-
+        self.feature_cache = None
+        self.profiler = None
+        self.log_domain = False
+        self.compact_emission = False
+        self.pyin_segments = 1
+        self.pyin_executor = None
+        # 'pyin' (offline default) or 'yin' (fast, for live use), see pitch.PITCH_BACKENDS
+        self.pitch_backend = 'pyin'
+        self.pitch_options = {}
+        # decode only the notes found in the take (plus range_margin semitones), see _occupied_range
+        self.adaptive_range = False
+        self.range_margin = 2
+        # (lowest, highest) note of the states of the last process() call
+        self.states_range = None
+
+
+    def _stage(self, name, input_size=None):
+        if self.profiler is None:
+            return _no_profiling
+        return self.profiler.stage(name, input_size)
 
     def note_validate(self, string):
         reg =  r'^[A-G][0-6]$'
@@ -36,184 +70,306 @@ class NotesProcess():
 
     def set_min_note(self, m_note: str):
         if self.note_validate(m_note):
-            minimum_note = m_note
+            self.minimum_note = m_note
 
     def set_max_note(self,m_note: str):
         if self.note_validate(m_note):
-            max_note = m_note
+            self.max_note = m_note
+
+    def model_notes(self):
+        # notes of the configured range; a pruned range (adaptive_range) keeps its
+        # transition probabilities, see note_hmm.transition_probabilities
+        return librosa.note_to_midi(self.max_note) - librosa.note_to_midi(self.minimum_note) + 1
 
-    def _build_transition_matrix(self, minimum_note, max_note, p_stay_note, p_stay_silence):
+    def _build_transition_matrix(self, minimum_note, max_note, p_stay_note, p_stay_silence, kind='dense',
+                                 model_notes=None):
 
         midi_min = librosa.note_to_midi(minimum_note)
         midi_max = librosa.note_to_midi(max_note)
         n_notes = midi_max - midi_min + 1
-        p_ = (1 - p_stay_silence) / n_notes
-        p__ = (1 - p_stay_note) / (n_notes + 1)
 
         # Transition matrix:
         # State 0 = silencio
         # States 1, 3, 5... = inicio (onsets)
         # States 2, 4, 6... = susteim (sustains)
-        np_matrix = np.zeros((2 * n_notes + 1, 2 * n_notes + 1))
+        # built once per parameter set and cached (read-only), see note_hmm.transition_matrix
+        return transition_matrix(n_notes, p_stay_note, p_stay_silence, kind, model_notes)
 
-        # State 0: silencio
-        np_matrix[0, 0] = p_stay_silence
-        for i in range(n_notes):
-            np_matrix[0, (i * 2) + 1] = p_
 
-        # States 1, 3, 5... = onsets
-        for i in range(n_notes):
-            np_matrix[(i * 2) + 1, (i * 2) + 2] = 1
+    def _spectral_frontend(self, y, sr, n_fft, hop_length):
+        # one STFT shared by the onset envelope and the rms used for backtracking
+        S = np.abs(librosa.stft(y=y, n_fft=n_fft, hop_length=hop_length))
 
-        # States 2, 4, 6... = sustains
-        for i in range(n_notes):
-            np_matrix[(i * 2) + 2, 0] = p__
-            np_matrix[(i * 2) + 2, (i * 2) + 2] = p_stay_note
-            for j in range(n_notes):
-                np_matrix[(i * 2) + 2, (j * 2) + 1] = p__
+        # same as onset_strength(y=y): log-power mel spectrogram, then spectral flux
+        mel = librosa.feature.melspectrogram(S=S**2, sr=sr)
+        onset_env = librosa.onset.onset_strength(S=librosa.power_to_db(mel), sr=sr, n_fft=n_fft, hop_length=hop_length)
+        rms = librosa.feature.rms(S=S, frame_length=n_fft, hop_length=hop_length)
+        return onset_env, rms
 
-        return np_matrix
+    def _detect_onsets(self, y, sr, n_fft, hop_length):
+        onset_env, rms = self._spectral_frontend(y, sr, n_fft, hop_length)
+        onsets_raw = librosa.onset.onset_detect(y=y, sr=sr, onset_envelope=onset_env, hop_length=hop_length, backtrack=False,)
+        # onset_backtrack raises on an empty event list (e.g. a window of digital silence)
+        if len(onsets_raw) == 0:
+            onset_backtrack = np.zeros(0, dtype=onsets_raw.dtype)
+        else:
+            onset_backtrack = librosa.onset.onset_backtrack(onsets_raw, rms[0])
 
+        # clicks = librosa.clicks(frames=self.onset_backtrack, sr=sr, length=len(y))
+        # sd.play(y+clicks, sr)
+        # time.sleep(20)
+        return onset_env, onsets_raw, rms, onset_backtrack
 
-    def _calc_probabilities(self, y, minimum_note, max_note, sr, frame_length, window_length, hop_length,
-                            pitch_acc, voiced_acc, onset_acc, spread):
+    def _estimate_pitch(self, y, sr, fmin, fmax, frame_length, window_length, hop_length):
+        # F0 and voicing
+        if self.pitch_backend == 'pyin' and self.pyin_segments > 1:
+            # overlapping segments in a process pool, see pitch.pyin_parallel;
+            # the pool is started on the first call and kept until close()
+            if self.pyin_executor is None:
+                self.pyin_executor = pyin_pool(self.pyin_segments)
+            return pyin_parallel(y, sr, fmin * 0.9, fmax * 1.1, frame_length, window_length, hop_length,
+                                 self.pyin_segments, executor=self.pyin_executor)
+        backend = get_pitch_backend(self.pitch_backend)
+        return backend(y, sr, fmin * 0.9, fmax * 1.1, frame_length, window_length, hop_length, **self.pitch_options)
+
+    def _extract_features(self, y, sr, minimum_note, max_note, frame_length, window_length, hop_length):
         fmin = librosa.note_to_hz(minimum_note)
         fmax = librosa.note_to_hz(max_note)
+
+        key = None
+        if self.feature_cache is not None:
+            key = self.feature_cache.key(y, sr, frame_length=frame_length, window_length=window_length,
+                                         hop_length=hop_length, fmin=fmin, fmax=fmax,
+                                         pitch_backend=self.pitch_backend,
+                                         pitch_options=sorted(self.pitch_options.items()))
+            features = self.feature_cache.get(key)
+            if features is not None:
+                return features
+
+        with self._stage('onsets', len(y)):
+            onset_env, onsets_raw, rms, onset_backtrack = self._detect_onsets(y, sr, frame_length, hop_length)
+        with self._stage('pyin', len(y)):
+            f0, voiced_flag, voiced_prob = self._estimate_pitch(y, sr, fmin, fmax, frame_length, window_length, hop_length)
+
+        features = {'onset_env': onset_env, 'onsets_raw': onsets_raw, 'rms': rms, 'onset_backtrack': onset_backtrack,
+                    'f0': f0, 'voiced_flag': voiced_flag, 'voiced_prob': voiced_prob}
+        if key is not None:
+            self.feature_cache.put(key, features)
+        return features
+
+    def _calc_probabilities(self, y, minimum_note, max_note, sr, frame_length, window_length, hop_length,
+                            pitch_acc, voiced_acc, onset_acc, spread, log_domain=False, compact=False):
+        features = self._extract_features(y, sr, minimum_note, max_note, frame_length, window_length, hop_length)
+        with self._stage('emission', len(features['f0'])):
+            return self._calc_emission(features, minimum_note, max_note, pitch_acc, voiced_acc, onset_acc, spread,
+                                       log_domain, compact)
+
+    def _calc_emission(self, features, minimum_note, max_note, pitch_acc, voiced_acc, onset_acc, spread,
+                       log_domain=False, compact=False):
         midi_min = librosa.note_to_midi(minimum_note)
         midi_max = librosa.note_to_midi(max_note)
         n_notes = midi_max - midi_min + 1
 
-        self.onset_env = librosa.onset.onset_strength(y=y, sr=sr)
-        self.onsets_raw = librosa.onset.onset_detect(y=y, sr=sr, onset_envelope=self.onset_env, hop_length=hop_length, backtrack=False,)
-        S = np.abs(librosa.stft(y=y))
-        rms = librosa.feature.rms(S=S)
-        self.onset_backtrack = librosa.onset.onset_backtrack(self.onsets_raw, rms[0])
+        self.onset_env = features['onset_env']
+        self.onsets_raw = features['onsets_raw']
+        self.onset_backtrack = features['onset_backtrack']
 
-        # clicks = librosa.clicks(frames=self.onset_backtrack, sr=sr, length=len(y))
-        # sd.play(y+clicks, sr)
-        # time.sleep(20)
-
-        # F0 and voicing
-        f0, voiced_flag, voiced_prob = librosa.pyin(y= y, fmin= fmin * 0.9, fmax= fmax * 1.1, sr= sr, frame_length= frame_length, win_length= window_length, hop_length= hop_length)
+        f0 = features['f0']
         tuning = librosa.pitch_tuning(f0)
         f0_ = np.round(librosa.hz_to_midi(f0 - tuning)).astype(int)
-        
-
-        P = np.ones((n_notes * 2 + 1, len(f0)))
 
-        for t in range(len(f0)):
-            # probability of silence or onset = 1-voiced_prob
-            # Probability of a note = voiced_prob * (pitch_acc) (estimated note)
-            if voiced_flag[t] == False:
-                P[0, t] = voiced_acc
-            else:
-                P[0, t] = 1 - voiced_acc
-
-            for j in range(n_notes):
-                if t in self.onset_backtrack:
-                    P[(j * 2) + 1, t] = onset_acc
-                else:
-                    P[(j * 2) + 1, t] = 1 - onset_acc
-
-                if j + midi_min == f0_[t]:
-                    P[(j * 2) + 2, t] = pitch_acc
-
-                elif np.abs(j + midi_min - f0_[t]) == 1:
-                    P[(j * 2) + 2, t] = pitch_acc * spread
-
-                else:
-                    P[(j * 2) + 2, t] = 1 - pitch_acc
+        if self.adaptive_range:
+            midi_min, midi_max = self._occupied_range(f0_, features['voiced_flag'], midi_min, midi_max,
+                                                      self.range_margin)
+            n_notes = midi_max - midi_min + 1
+        self.states_range = (librosa.midi_to_note(midi_min, unicode=False),
+                             librosa.midi_to_note(midi_max, unicode=False))
+
+        return self._build_emission(f0_, features['voiced_flag'], self.onset_backtrack, midi_min, n_notes,
+                                    pitch_acc, voiced_acc, onset_acc, spread, log_domain, compact)
+
+    def _occupied_range(self, f0_, voiced_flag, midi_min, midi_max, margin):
+        # histogram of the voiced f0_ that reach a state of [midi_min, midi_max]:
+        # the lowest and highest notes that occur, widened by margin and clipped
+        # to the range. A pitch one semitone outside (pyin searches fmin*0.9 to
+        # fmax*1.1) still gives the edge note next_pitch, so it counts as that
+        # edge note. Notes further away only ever get other_pitch in the emission.
+        # With margin >= 1 and the transition probabilities of the full range (see
+        # _decode) the decoded notes usually match the full model, but not on a
+        # tie: a note whose sustain frames all get other_pitch is resolved to the
+        # lowest state, midi_min in the full model and the pruned minimum here.
+        # Without any such voiced frame the full range is kept.
+        notes = f0_[np.asarray(voiced_flag, dtype=bool)]
+        notes = notes[(notes >= midi_min - 1) & (notes <= midi_max + 1)]
+        if len(notes) == 0:
+            return midi_min, midi_max
+        notes = np.clip(notes, midi_min, midi_max)
+        used = np.flatnonzero(np.bincount(notes - midi_min, minlength=midi_max - midi_min + 1))
+        return max(midi_min, midi_min + used[0] - margin), min(midi_max, midi_min + used[-1] + margin)
+
+    def _build_emission(self, f0_, voiced_flag, onset_frames, midi_min, n_notes, pitch_acc, voiced_acc, onset_acc, spread,
+                        log_domain=False, compact=False):
+        n_frames = len(f0_)
+
+        values = np.array([voiced_acc, 1 - voiced_acc, onset_acc, 1 - onset_acc,
+                           pitch_acc, pitch_acc * spread, 1 - pitch_acc])
+
+        onset_frames = np.asarray(onset_frames, dtype=int)
+        is_onset = np.zeros(n_frames, dtype=bool)
+        is_onset[onset_frames[(onset_frames >= 0) & (onset_frames < n_frames)]] = True
+
+        if compact:
+            # per-frame factors only, the decoder builds each log column on the fly (see note_hmm.NoteEmission)
+            return NoteEmission(voiced_flag, is_onset, f0_ - midi_min, n_notes,
+                                np.log(values + np.finfo(np.float64).tiny))
+
+        if log_domain:
+            # float32 log-likelihoods written directly: log(p + tiny) as in librosa.sequence.viterbi,
+            # computed once per distinct value instead of over the whole matrix
+            # Tolerance: float32 rounding of these values can flip a near-tie in the
+            # Viterbi, giving a different path on a few frames (an onset/sustain swap);
+            # with the default parameters the paths on our recordings are identical,
+            # tests/test_viterbi.py allows at most 0.2% of frames to differ otherwise
+            P = np.empty((n_notes * 2 + 1, n_frames), dtype=np.float32)
+            values = np.log(values + np.finfo(np.float64).tiny).astype(np.float32)
+        else:
+            P = np.ones((n_notes * 2 + 1, n_frames))
+        unvoiced, voiced, onset, no_onset, same_pitch, next_pitch, other_pitch = values
+
+        # probability of silence or onset = 1-voiced_prob
+        P[0] = np.where(voiced_flag, voiced, unvoiced)
+
+        # onsets: same probability for every note, depends only on the frame being an onset
+        P[1::2] = np.where(is_onset, onset, no_onset)
+
+        # Probability of a note = voiced_prob * (pitch_acc) (estimated note)
+        # only the estimated note and its two neighbours differ from other_pitch in each frame
+        sustain = P[2::2]
+        sustain[:] = other_pitch
+        frames = np.arange(n_frames)
+        for offset, value in ((-1, next_pitch), (1, next_pitch), (0, same_pitch)):
+            row = f0_ - midi_min + offset
+            valid = (row >= 0) & (row < n_notes)
+            sustain[row[valid], frames[valid]] = value
 
         return P
 
 
-    def _convert_states_to_pianoroll(self, states, minimum_note, max_note, hop_time):
+    def _convert_states_to_pianoroll(self, states, minimum_note, max_note, hop_time, states_min_note=None):
+        # states_min_note: lowest note of the states when they were decoded over
+        # a narrower range (states_range[0] after process() with adaptive_range);
+        # 'midi' is absolute and 'name' indexes the minimum_note..max_note names either way
         midi_min = librosa.note_to_midi(minimum_note)
         midi_max = librosa.note_to_midi(max_note)
-
-        states_ = np.hstack((states, np.zeros(1)))
-
-        #states
-        silence = 0
-        onset = 1
-        sustain = 2
-
-        my_state = silence
-        output = []
-
-        last_onset = 0
-        last_offset = 0
-        last_midi = 0
-        for i in range(len(states_)):
-            if my_state == silence:
-                if int(states_[i] % 2) != 0:
-                    # achou inicio
-                    last_onset = i * hop_time
-                    last_midi = ((states_[i] - 1) / 2) + midi_min
-                    last_note = librosa.midi_to_note(last_midi)
-                    my_state = onset
-
-            elif my_state == onset:
-                if int(states_[i] % 2) == 0:
-                    my_state = sustain
-
-            elif my_state == sustain:
-                if int(states_[i] % 2) != 0:
-                    # achou inicio
-                    # para a nota anterior
-                    last_offset = i * hop_time
-                    my_note = [last_onset, last_offset, last_midi, last_note]
-                    output.append(my_note)
-
-                    # comeca a nova nota
-                    last_onset = i * hop_time
-                    last_midi = ((states_[i] - 1) / 2) + midi_min
-                    last_note = librosa.midi_to_note(last_midi)
-                    my_state = onset
-
-                elif states_[i] == 0:
-                    # achou silencio.
-                    # para a nota anterior.
-                    last_offset = i * hop_time
-                    my_note = [last_onset, last_offset, last_midi, last_note]
-                    output.append(my_note)
-                    my_state = silence
-
+        states_midi_min = midi_min if states_min_note is None else librosa.note_to_midi(states_min_note)
+
+        # run-length version of the silence/onset/sustain walk over the states
+        # (with a trailing silence frame):
+        # - a note starts on the first frame of every run of onset states (odd)
+        # - the first frame after that run only moves it to sustain
+        # - from the next frame on, it ends at the first silence or onset
+        # a note whose run reaches the end without that frame is dropped
+        states = np.asarray(states, dtype=np.int64)
+        n_frames = len(states)
+        is_onset = np.zeros(n_frames + 2, dtype=bool)
+        is_onset[1:-1] = states % 2 != 0
+        changes = np.diff(is_onset.view(np.int8))
+        starts = np.flatnonzero(changes == 1)
+        run_ends = np.flatnonzero(changes == -1)
+
+        # frames that end a sustained note, the appended silence included
+        boundaries = np.append(np.flatnonzero((states == 0) | is_onset[1:-1]), n_frames)
+        k = np.searchsorted(boundaries, run_ends + 1)
+        keep = k < len(boundaries)
+        starts = starts[keep]
+
+        note_index = (states[starts] - 1) // 2
+        output = np.empty(len(starts), dtype=PIANOROLL_DTYPE)
+        output['onset'] = starts * hop_time
+        output['offset'] = boundaries[k[keep]] * hop_time
+        output['midi'] = note_index + states_midi_min
+        output['name'] = note_index + states_midi_min - midi_min
         return output
 
-    def _convert_pianoroll_to_midi(self, y, sr, pianoroll):
+    def piano_roll(self, sr, states=None, states_range=None):
+        # notes of the last process() call, or of states decoded over states_range
+        # (default: the range of the last _calc_emission)
+        if states is None:
+            states = self.states
+        if states_range is None:
+            states_range = self.states_range
+        return self._convert_states_to_pianoroll(states, self.minimum_note, self.max_note, self.hop_length / sr,
+                                                 states_range[0])
+
+    def _note_names(self, minimum_note, max_note):
+        # index with the 'name' field of _convert_states_to_pianoroll
+        return note_names(librosa.note_to_midi(minimum_note), librosa.note_to_midi(max_note))
+
+    def _midi_tempo(self, y, sr):
         # onset_env = librosa.onset.onset_strength(y=y, sr=sr)
-        bpm = librosa.feature.tempo(y=y, onset_envelope=self.onset_env, sr=sr)
-
-        quarter_note = 60 / bpm
-        ticks_per_quarter = 1024
-
-        onsets = np.array([p[0] for p in pianoroll])
-        offsets = np.array([p[1] for p in pianoroll])
-
-        onsets = onsets / quarter_note
-        offsets = offsets / quarter_note
-        durations = offsets - onsets
-
-        MyMIDI = midiutil.MIDIFile(1)
-        MyMIDI.addTempo(0, 0, bpm)
+        return float(librosa.feature.tempo(y=y, onset_envelope=self.onset_env, sr=sr)[0])
 
-        for i in range(len(onsets)):
-            MyMIDI.addNote(0, 0, int(pianoroll[i][2]), onsets[i], durations[i], 100)
-
-        return MyMIDI
+    def _convert_pianoroll_to_midi(self, y, sr, pianoroll):
+        # bytes of the .mid file, see midi_writer.MidiWriter
+        return encode_midi(pianoroll, self._midi_tempo(y, sr))
     
     
 
     def process(self, y, sr):
-        transition_matrix = self._build_transition_matrix(self.minimum_note, self.max_note, self.p_stay_note, self.p_stay_silence)
+        if self.profiler is not None:
+            self.profiler.begin(len(y) / sr)
         prob = self._calc_probabilities(y, self.minimum_note, self.max_note, sr, self.frame_length, self.window_length,
-                                    self.hop_length, self.pitch_acc, self.voiced_acc, self.onset_acc, self.spread)
-        init_mat = np.zeros( transition_matrix.shape[0])
-        init_mat[0] = 1
-        self.states = librosa.sequence.viterbi(prob, transition_matrix, p_init=init_mat)
+                                    self.hop_length, self.pitch_acc, self.voiced_acc, self.onset_acc, self.spread,
+                                    self.log_domain, self.compact_emission)
+        with self._stage('viterbi', prob.shape[1]):
+            self.states = self._decode(prob, self.states_range[0], self.states_range[1], self.p_stay_note,
+                                       self.p_stay_silence, self.log_domain, self.model_notes())
+        if self.profiler is not None:
+            self.profiler.end()
+
+    def process_batch(self, ys, srs):
+        # process() for several signals with their Viterbi decoding done in one
+        # batched pass (one per note range with adaptive_range).
+        # Returns (states, states_range, onset_env) per signal.
+        if self.profiler is not None:
+            self.profiler.begin(sum(len(y) / sr for y, sr in zip(ys, srs)))
+        items = []
+        for y, sr in zip(ys, srs):
+            prob = self._calc_probabilities(y, self.minimum_note, self.max_note, sr, self.frame_length,
+                                            self.window_length, self.hop_length, self.pitch_acc, self.voiced_acc,
+                                            self.onset_acc, self.spread, self.log_domain, self.compact_emission)
+            items.append((prob, self.states_range, self.onset_env))
+
+        model_notes = self.model_notes()
+        groups = {}
+        for i, (_, states_range, _) in enumerate(items):
+            groups.setdefault(states_range, []).append(i)
+        states = [None] * len(items)
+        with self._stage('viterbi', sum(prob.shape[1] for prob, _, _ in items)):
+            for states_range, indices in groups.items():
+                decoded = self._decode_batch([items[i][0] for i in indices], states_range[0], states_range[1],
+                                             self.p_stay_note, self.p_stay_silence, self.log_domain, model_notes)
+                for i, path in zip(indices, decoded):
+                    states[i] = path
+        if self.profiler is not None:
+            self.profiler.end()
+        return [(path, states_range, onset_env) for path, (_, states_range, onset_env) in zip(states, items)]
+
+    def _decode_batch(self, probs, minimum_note, max_note, p_stay_note, p_stay_silence, log_domain=False,
+                      model_notes=None):
+        # see note_hmm.NoteViterbi.decode_batch
+        n_notes = librosa.note_to_midi(max_note) - librosa.note_to_midi(minimum_note) + 1
+        return note_viterbi(n_notes, p_stay_note, p_stay_silence, model_notes).decode_batch(probs, log_domain=log_domain)
+
+    def _decode(self, prob, minimum_note, max_note, p_stay_note, p_stay_silence, log_domain=False, model_notes=None):
+        # log_domain: prob already holds log-likelihoods (see _build_emission), a NoteEmission always does
+        # model_notes: see note_hmm.transition_probabilities
+        n_notes = librosa.note_to_midi(max_note) - librosa.note_to_midi(minimum_note) + 1
+        return note_viterbi(n_notes, p_stay_note, p_stay_silence, model_notes).decode(prob, log_domain=log_domain)
 
     def highpass_filter(self, y, sr):
+        from scipy import signal
+
         filter_stop_freq = 70  # Hz
         filter_pass_freq = 100  # Hz
         filter_order = 1001
@@ -228,36 +384,63 @@ class NotesProcess():
         filtered_audio = signal.filtfilt(filter_coefs, [1], y)
         return filtered_audio
 
-    def getNotesPianoFormart(self, y, sr):
-        audio_file_path = "track3-estrofe.wav"
-        # audio_file_path = "marcha.m4a"
-        y, sr = librosa.load(audio_file_path)
+    def getNotesPianoFormart(self, y, sr, midi_path="out.mid"):
+        if y is None:
+            audio_file_path = "track3-estrofe.wav"
+            # audio_file_path = "marcha.m4a"
+            y, sr = librosa.load(audio_file_path)
         # y = self.highpass_filter(y, sr)
         # y = librosa.util.normalize(y)
         self.process(y, sr)
-        piano_format = self._convert_states_to_pianoroll(self.states, self.minimum_note, self.max_note, self.hop_length/sr)
+        piano_format = self.piano_roll(sr)
         # print(piano_format)
         # print(f'len states {len(self.states)}')
-        print(f'len piano {len([p[0] for p in piano_format])}')
-        print(f'{([p[0] for p in piano_format])}')
+        print(f'len piano {len(piano_format)}')
+        print(f'{piano_format["onset"].tolist()}')
         # print(f'len onsets {len(self.onset_backtrack)}')
         print(f'{len(librosa.frames_to_time(self.onset_backtrack, sr=sr))}')
         print(f'times onsets {librosa.frames_to_time(self.onset_backtrack, sr=sr)}')
 
-        cont = 0
-        for el in piano_format:
-            for ell in librosa.frames_to_time(self.onset_backtrack, sr=sr):
-                if float("{:.2f}".format(el[0])) == float("{:.2f}".format(ell)):
-                    cont+=1
-                    break  
-        print("Contttttttt  " + str(cont))
-        # return piano_format
-        self.toMidi(y=y, sr=sr, piano_format=piano_format)
-
-    def toMidi(self, y, sr, piano_format):
-        midi_format = self._convert_pianoroll_to_midi(y, sr, piano_format)
-        with open("out.mid", "wb") as output_file:
-            midi_format.writeFile(output_file)
+        scores = onset_scores(piano_format['onset'], librosa.frames_to_time(self.onset_backtrack, sr=sr))
+        print("Contttttttt  " + str(scores['matches']))
+        print('P {precision:.3f} R {recall:.3f} F {f_measure:.3f}'.format(**scores))
+        if midi_path is not None:
+            self.toMidi(y=y, sr=sr, piano_format=piano_format, path=midi_path)
+        return piano_format
+
+    def transcribe_file(self, audio_file_path, midi_path):
+        y, sr = librosa.load(audio_file_path)
+        self.process(y, sr)
+        piano_format = self.piano_roll(sr)
+        self.toMidi(y=y, sr=sr, piano_format=piano_format, path=midi_path)
+        return piano_format, len(y) / sr
+
+    def transcribe_batch(self, ys, srs, midi_paths):
+        # transcribe_file() for signals already loaded, decoded together (see process_batch)
+        results = []
+        for y, sr, midi_path, (states, states_range, onset_env) in zip(ys, srs, midi_paths,
+                                                                      self.process_batch(ys, srs)):
+            self.states, self.states_range, self.onset_env = states, states_range, onset_env
+            piano_format = self.piano_roll(sr)
+            self.toMidi(y=y, sr=sr, piano_format=piano_format, path=midi_path)
+            results.append((piano_format, len(y) / sr))
+        return results
+
+    def warm_up(self, sr=22050):
+        # one second of A4 through process(): librosa is imported and its numba
+        # code compiled here instead of on the first real signal
+        y = librosa.tone(librosa.note_to_hz('A4'), sr=sr, duration=1.0).astype(np.float32)
+        self.process(y, sr)
+
+    def close(self):
+        # stops the pyin pool of pyin_segments > 1
+        if self.pyin_executor is not None:
+            self.pyin_executor.shutdown()
+            self.pyin_executor = None
+
+    def toMidi(self, y, sr, piano_format, path="out.mid"):
+        # path: file name or binary file-like object
+        write_midi(piano_format, path, self._midi_tempo(y, sr))
     
 
 
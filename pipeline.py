@@ -0,0 +1,212 @@
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+import pool_worker
+
+def _features(y, sr):
+    # onsets, F0 and the (compact) emission of one chunk
+    notes_p = pool_worker.notes_process()
+    prob = notes_p._calc_probabilities(y, notes_p.minimum_note, notes_p.max_note, sr, notes_p.frame_length,
+                                       notes_p.window_length, notes_p.hop_length, notes_p.pitch_acc,
+                                       notes_p.voiced_acc, notes_p.onset_acc, notes_p.spread, compact=True)
+    return prob, notes_p.states_range, sr
+
+
+def _decode(prob, states_range, sr):
+    notes_p = pool_worker.notes_process()
+    states = notes_p._decode(prob, states_range[0], states_range[1], notes_p.p_stay_note, notes_p.p_stay_silence,
+                             model_notes=notes_p.model_notes())
+    return notes_p.piano_roll(sr, states, states_range)
+
+
+class StageStats():
+    # per stage: items done, time in the stage (queue wait + work) and depth of its input queue
+
+    def __init__(self, name):
+        self.name = name
+        self.count = 0
+        self.total_seconds = 0.0
+        self.last_seconds = 0.0
+        self.max_seconds = 0.0
+        self.depth = 0
+        self.max_depth = 0
+
+    def add(self, seconds, depth):
+        self.count += 1
+        self.total_seconds += seconds
+        self.last_seconds = seconds
+        self.max_seconds = max(self.max_seconds, seconds)
+        self.depth = depth
+        self.max_depth = max(self.max_depth, depth)
+
+    @property
+    def mean_seconds(self):
+        return self.total_seconds / self.count if self.count else 0.0
+
+    def as_dict(self):
+        return {'name': self.name, 'count': self.count, 'mean_seconds': self.mean_seconds,
+                'last_seconds': self.last_seconds, 'max_seconds': self.max_seconds, 'depth': self.depth,
+                'max_depth': self.max_depth}
+
+    def __str__(self):
+        return '{} {:.0f}/{:.0f}ms fila {}/{}'.format(self.name, 1000 * self.mean_seconds, 1000 * self.max_seconds,
+                                                     self.depth, self.max_depth)
+
+
+class _Chunk():
+
+    def __init__(self, index, y, sr, start_time):
+        self.index = index
+        self.y = y
+        self.sr = sr
+        self.start_time = start_time      # seconds from the start of the capture
+        self.captured = time.perf_counter()
+        self.queued = self.captured
+        self.result = None
+
+
+class LivePipeline():
+    # capture -> features -> decode -> output, for independent chunks.
+    #
+    # put() is called by the capture side with every complete chunk. Features
+    # (onsets, F0, emission) run in a pool of `feature_workers` processes and
+    # decoding (Viterbi + piano roll) in its own process, so one chunk is decoded
+    # while the next ones are analysed. Stages are joined by bounded queues:
+    # when a stage falls behind, put() blocks and the audio waits in the ring
+    # buffer instead of piling up here. output(piano_format, start_time) is
+    # called on the output thread in capture order.
+    #
+    # Each stage keeps a StageStats; `latency` is capture -> output per chunk.
+    # `budget` (seconds, e.g. one bar) counts the chunks that took longer.
+
+    def __init__(self, output, feature_workers=None, queue_size=2, pitch_backend='pyin', pitch_options=None,
+                 budget=None, report=None, warm_up=True):
+        self.output = output
+        self.feature_workers = feature_workers or max(1, (os.cpu_count() or 1) - 1)
+        self.budget = budget
+        self.report = report
+        # a NotesProcess per worker, started (and warmed) before the first chunk arrives
+        initializer = partial(pool_worker.init_worker, None, warm_up, pitch_backend=pitch_backend,
+                              pitch_options=dict(pitch_options or {}), compact_emission=True)
+        self.feature_pool = ProcessPoolExecutor(max_workers=self.feature_workers, initializer=initializer)
+        self.decode_pool = ProcessPoolExecutor(max_workers=1, initializer=initializer)
+        pool_worker.start_workers(self.feature_pool, self.feature_workers)
+        pool_worker.start_workers(self.decode_pool, 1)
+
+        self.features_queue = queue.Queue(queue_size)
+        self.decode_queue = queue.Queue(queue_size)
+        self.output_queue = queue.Queue(queue_size)
+        self.stats = {name: StageStats(name) for name in ('features', 'decode', 'output')}
+        self.latency = StageStats('total')
+        self.late = 0
+        self.errors = 0
+        self._n_chunks = 0
+        self._stats_lock = threading.Lock()
+
+        self._feature_threads = [threading.Thread(target=self._run_stage,
+                                                  args=('features', self.features_queue, self.decode_queue,
+                                                        self.feature_pool, _features))
+                                 for _ in range(self.feature_workers)]
+        self._decode_thread = threading.Thread(target=self._run_stage,
+                                               args=('decode', self.decode_queue, self.output_queue,
+                                                     self.decode_pool, _decode))
+        self._output_thread = threading.Thread(target=self._run_output)
+        for thread in self._feature_threads + [self._decode_thread, self._output_thread]:
+            thread.start()
+
+    def put(self, y, sr, start_time):
+        chunk = _Chunk(self._n_chunks, y, sr, start_time)
+        self._n_chunks += 1
+        self.features_queue.put(chunk)
+
+    def _done(self, name, chunk, depth):
+        now = time.perf_counter()
+        with self._stats_lock:
+            self.stats[name].add(now - chunk.queued, depth)
+        chunk.queued = now
+
+    def _failed(self, name, chunk, error):
+        print('{} falhou no trecho {}: {}'.format(name, chunk.index, type(error).__name__ + ': ' + str(error)))
+        with self._stats_lock:
+            self.errors += 1
+
+    def _run_stage(self, name, inbox, outbox, pool, func):
+        while True:
+            chunk = inbox.get()
+            if chunk is None:
+                return
+            depth = inbox.qsize()
+            # features take the audio, decode the features; a chunk that already failed is passed on
+            args = (chunk.y, chunk.sr) if chunk.y is not None else chunk.result
+            chunk.y = None
+            if args is not None:
+                try:
+                    chunk.result = pool.submit(func, *args).result()
+                except Exception as e:
+                    chunk.result = None
+                    self._failed(name, chunk, e)
+            self._done(name, chunk, depth)
+            outbox.put(chunk)
+
+    def _run_output(self):
+        # feature workers can finish out of order; chunks are written in capture order
+        pending = {}
+        next_index = 0
+        while True:
+            chunk = self.output_queue.get()
+            if chunk is None:
+                return
+            depth = self.output_queue.qsize()
+            pending[chunk.index] = chunk
+            while next_index in pending:
+                chunk = pending.pop(next_index)
+                next_index += 1
+                # a failing output (print, MidiWriter) must not stop the thread: upstream would block on put()
+                if chunk.result is not None:
+                    try:
+                        self.output(chunk.result, chunk.start_time)
+                    except Exception as e:
+                        self._failed('output', chunk, e)
+                self._done('output', chunk, depth)
+                latency = time.perf_counter() - chunk.captured
+                self.latency.add(latency, len(pending))
+                if self.budget is not None and latency > self.budget:
+                    self.late += 1
+                if self.report is not None:
+                    try:
+                        self.report(self.summary(chunk.index))
+                    except Exception as e:
+                        self._failed('report', chunk, e)
+
+    def summary(self, index=None):
+        head = 'trecho {} '.format(index) if index is not None else ''
+        stages = ', '.join(str(self.stats[name]) for name in ('features', 'decode', 'output'))
+        return '{}latencia {:.0f}ms (max {:.0f}ms), {}'.format(head, 1000 * self.latency.last_seconds,
+                                                               1000 * self.latency.max_seconds, stages)
+
+    def close(self):
+        # lets every queued chunk through, then stops the threads and the workers
+        for _ in self._feature_threads:
+            self.features_queue.put(None)
+        for thread in self._feature_threads:
+            thread.join()
+        self.decode_queue.put(None)
+        self._decode_thread.join()
+        self.output_queue.put(None)
+        self._output_thread.join()
+        self.feature_pool.shutdown()
+        self.decode_pool.shutdown()
+
+    def as_dict(self):
+        return {'chunks': self._n_chunks, 'late': self.late, 'errors': self.errors, 'budget': self.budget,
+                'latency': self.latency.as_dict(), 'stages': [s.as_dict() for s in self.stats.values()]}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
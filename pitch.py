@@ -0,0 +1,165 @@
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import librosa
+
+DEFAULT_OVERLAP_SECONDS = 1.0
+DEFAULT_YIN_THRESHOLD = 0.2
+
+# Pitch backends: f(y, sr, fmin, fmax, frame_length, window_length, hop_length, **options)
+# -> (f0, voiced_flag, voiced_prob) on pyin's centred frame grid (1 + len(y) // hop_length
+# frames), f0 = nan where unvoiced. Registered in PITCH_BACKENDS by name.
+
+
+def _pyin(y, sr, fmin, fmax, frame_length, window_length, hop_length):
+    return librosa.pyin(y=y, fmin=fmin, fmax=fmax, sr=sr, frame_length=frame_length, win_length=window_length,
+                        hop_length=hop_length)
+
+
+def pyin_backend(y, sr, fmin, fmax, frame_length, window_length, hop_length):
+    # probabilistic YIN with its own Viterbi over pitch and voicing (the offline default)
+    return _pyin(y, sr, fmin, fmax, frame_length, window_length, hop_length)
+
+
+def _cumulative_mean_normalized_difference(y_frames, min_period, max_period):
+    # equation 8 of de Cheveigne & Kawahara (2002) over a simplified difference:
+    # d(tau) = 2 * (r(0) - r(tau)) - energy of the first tau samples, from the
+    # autocorrelation of the whole frame. The energy of the last tau samples is
+    # left out and there is no integration window (window_length is unused),
+    # the same as the difference librosa 0.11 uses in yin and pyin; the
+    # windowed equation 6 agreed less with our pyin notes.
+    acf = librosa.autocorrelate(y_frames, max_size=max_period + 1, axis=0)
+    energy = np.cumsum(np.square(y_frames[:max_period]), axis=0)
+    difference = np.empty((max_period + 1, y_frames.shape[1]))
+    difference[0] = 0
+    difference[1:] = 2 * (acf[0:1] - acf[1:]) - energy
+    cumulative_mean = np.cumsum(difference[1:], axis=0) / np.arange(1, max_period + 1)[:, np.newaxis]
+    return difference[min_period:] / (cumulative_mean[min_period - 1:] + np.finfo(np.float64).tiny)
+
+
+def yin_backend(y, sr, fmin, fmax, frame_length, window_length, hop_length, threshold=DEFAULT_YIN_THRESHOLD,
+                block_frames=1024):
+    # Plain YIN, no pitch/voicing HMM: a frame is voiced when its cumulative
+    # mean normalized difference has a trough below `threshold`; the period is
+    # the first such trough, refined by parabolic interpolation. voiced_prob is
+    # 1 - that difference; a frame of digital silence (difference 0 everywhere)
+    # is unvoiced with voiced_prob 0. Frames are processed in blocks to bound memory.
+    min_period = max(int(np.floor(sr / fmax)), 1)
+    max_period = min(int(np.ceil(sr / fmin)), frame_length - 1)
+    frames = librosa.util.frame(np.pad(np.asarray(y, dtype=np.float64), frame_length // 2),
+                                frame_length=frame_length, hop_length=hop_length)
+    n_frames = frames.shape[1]
+
+    f0 = np.full(n_frames, np.nan)
+    voiced_flag = np.zeros(n_frames, dtype=bool)
+    voiced_prob = np.zeros(n_frames)
+    for start in range(0, n_frames, block_frames):
+        cmnd = _cumulative_mean_normalized_difference(frames[:, start:start + block_frames], min_period, max_period)
+        columns = np.arange(cmnd.shape[1])
+
+        is_trough = librosa.util.localmin(cmnd, axis=0)
+        is_trough[0] = cmnd[0] < cmnd[1]
+        below = is_trough & (cmnd < threshold)
+        silent = ~np.any(frames[:, start:start + block_frames], axis=0)
+        voiced = below.any(axis=0) & ~silent
+        period = np.where(voiced, np.argmax(below, axis=0), np.argmin(cmnd, axis=0))
+
+        # parabolic interpolation around the chosen lag, not at the edges
+        inner = np.clip(period, 1, len(cmnd) - 2)
+        left, centre, right = cmnd[inner - 1, columns], cmnd[inner, columns], cmnd[inner + 1, columns]
+        curvature = left + right - 2 * centre
+        slope = (right - left) / 2
+        shift = np.zeros(len(period))
+        ok = (np.abs(slope) < np.abs(curvature)) & (inner == period)
+        shift[ok] = -slope[ok] / curvature[ok]
+
+        block = slice(start, start + len(period))
+        f0[block] = np.where(voiced, sr / (min_period + period + shift), np.nan)
+        voiced_flag[block] = voiced
+        voiced_prob[block] = np.where(silent, 0, np.clip(1 - cmnd[period, columns], 0, 1))
+    return f0, voiced_flag, voiced_prob
+
+
+PITCH_BACKENDS = {'pyin': pyin_backend, 'yin': yin_backend}
+
+
+def get_pitch_backend(name):
+    try:
+        return PITCH_BACKENDS[name]
+    except KeyError:
+        raise ValueError('unknown pitch backend {!r}, expected one of {}'.format(name, ', '.join(PITCH_BACKENDS)))
+
+
+def segment_bounds(n_samples, hop_length, n_segments, overlap_frames):
+    # Splits the pyin frames of a signal into n_segments contiguous ranges.
+    # Returns (first_frame, stop_frame, first_sample, stop_sample) per segment:
+    # the audio slice starts on a frame boundary and reaches overlap_frames
+    # beyond the range on both sides, so pyin's centred frames and its voicing
+    # HMM see real signal around every frame that is kept.
+    n_frames = 1 + n_samples // hop_length
+    edges = np.linspace(0, n_frames, n_segments + 1).round().astype(int)
+    bounds = []
+    for first, stop in zip(edges[:-1], edges[1:]):
+        if stop <= first:
+            continue
+        start_sample = max(0, first - overlap_frames) * hop_length
+        stop_sample = min(n_samples, (stop + overlap_frames) * hop_length)
+        bounds.append((first, stop, start_sample, stop_sample))
+    return bounds
+
+
+def _start_worker(seconds):
+    # importing this module in the worker imports librosa; the sleep keeps one
+    # worker busy so every task starts another process
+    time.sleep(seconds)
+
+
+def pyin_pool(n_workers):
+    # long-lived pool for pyin_parallel with its workers already started:
+    # a new pool per call costs more than splitting a take saves
+    # spawned, not forked: the caller may hold locks of librosa's thread pools
+    # (e.g. a batch.py worker after loading a file), which a forked child would inherit
+    pool = ProcessPoolExecutor(max_workers=n_workers, mp_context=multiprocessing.get_context('spawn'))
+    list(pool.map(_start_worker, [0.1] * n_workers))
+    return pool
+
+
+def pyin_parallel(y, sr, fmin, fmax, frame_length, window_length, hop_length, n_segments,
+                  overlap_seconds=DEFAULT_OVERLAP_SECONDS, executor=None):
+    # librosa.pyin over n_segments overlapping pieces of y in a process pool,
+    # stitched back into the single-pass (f0, voiced_flag, voiced_prob) frame grid.
+    # Kept frames are at least overlap_seconds away from a cut. Tolerance: frames
+    # can differ from single-pass pyin only where pyin's Viterbi path has not
+    # re-converged within that distance; on our recordings (and a 10 minute
+    # take cut into 64 segments) f0, voiced_flag and voiced_prob are identical.
+    # benchmark.py --pyin-segments reports the differences and the speedup.
+    overlap_frames = max(int(np.ceil(overlap_seconds * sr / hop_length)),
+                         int(np.ceil(frame_length / 2 / hop_length)))
+    bounds = segment_bounds(len(y), hop_length, n_segments, overlap_frames)
+    if len(bounds) < 2:
+        return _pyin(y, sr, fmin, fmax, frame_length, window_length, hop_length)
+
+    # without an executor a pool is started and stopped for this call only, see pyin_pool
+    own_executor = executor is None
+    if own_executor:
+        executor = ProcessPoolExecutor(max_workers=len(bounds))
+    try:
+        futures = [executor.submit(_pyin, y[start:stop], sr, fmin, fmax, frame_length, window_length, hop_length)
+                   for _, _, start, stop in bounds]
+        results = [future.result() for future in futures]
+    finally:
+        if own_executor:
+            executor.shutdown()
+
+    n_frames = 1 + len(y) // hop_length
+    f0 = np.empty(n_frames)
+    voiced_flag = np.empty(n_frames, dtype=bool)
+    voiced_prob = np.empty(n_frames)
+    for (first, stop, start_sample, _), (seg_f0, seg_flag, seg_prob) in zip(bounds, results):
+        offset = first - start_sample // hop_length
+        f0[first:stop] = seg_f0[offset:offset + stop - first]
+        voiced_flag[first:stop] = seg_flag[offset:offset + stop - first]
+        voiced_prob[first:stop] = seg_prob[offset:offset + stop - first]
+    return f0, voiced_flag, voiced_prob
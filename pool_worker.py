@@ -0,0 +1,37 @@
+import time
+from multiprocessing.util import Finalize
+
+# Process pool workers of batch.py, daemon.py and pipeline.py: one NotesProcess
+# per worker process, created by init_worker (the pool initializer, through
+# functools.partial) and reused by all of its tasks. Nothing heavy is imported
+# here, so the CLIs start without librosa in the parent process.
+
+_notes_p = None
+
+
+def init_worker(cache_dir=None, warm_up=False, **settings):
+    # settings: NotesProcess attributes, e.g. pitch_backend or compact_emission
+    global _notes_p
+    from notes_process import NotesProcess
+    _notes_p = NotesProcess()
+    for name, value in settings.items():
+        setattr(_notes_p, name, value)
+    if cache_dir is not None:
+        from feature_cache import FeatureCache
+        _notes_p.feature_cache = FeatureCache(cache_dir)
+    # a worker joins its child processes on exit, so a pyin pool (pyin_segments) is
+    # stopped first, before the queues of that pool are closed (their exitpriority is 10)
+    Finalize(None, _notes_p.close, exitpriority=20)
+    if warm_up:
+        _notes_p.warm_up()
+
+
+def notes_process():
+    # the NotesProcess of this worker
+    return _notes_p
+
+
+def start_workers(pool, n_workers):
+    # a ProcessPoolExecutor starts its processes (and runs init_worker) on
+    # demand; one sleeping task per worker starts all of them now
+    list(pool.map(time.sleep, [0.1] * n_workers))
@@ -0,0 +1,83 @@
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+
+class StageRecord():
+
+    def __init__(self, name, seconds, input_size, allocated_bytes=None):
+        self.name = name
+        self.seconds = seconds
+        self.input_size = input_size
+        self.allocated_bytes = allocated_bytes
+
+    def as_dict(self):
+        return {'name': self.name, 'seconds': self.seconds, 'input_size': self.input_size,
+                'allocated_bytes': self.allocated_bytes}
+
+
+class ProcessReport():
+    # timings of one NotesProcess.process call
+
+    def __init__(self, audio_duration):
+        self.audio_duration = audio_duration
+        self.total_seconds = 0.0
+        self.stages = []
+
+    @property
+    def real_time_factor(self):
+        # processing time / audio duration, < 1 means faster than real time
+        return self.total_seconds / self.audio_duration if self.audio_duration else None
+
+    def as_dict(self):
+        return {'audio_duration': self.audio_duration, 'total_seconds': self.total_seconds,
+                'real_time_factor': self.real_time_factor, 'stages': [s.as_dict() for s in self.stages]}
+
+    def __str__(self):
+        stages = ', '.join('{} {:.1f}ms'.format(s.name, 1000 * s.seconds) for s in self.stages)
+        return 'RTF {:.3f} ({:.1f}ms for {:.2f}s): {}'.format(
+            self.real_time_factor or 0.0, 1000 * self.total_seconds, self.audio_duration, stages)
+
+
+class Profiler():
+    # Opt-in instrumentation for NotesProcess: set notes_p.profiler = Profiler(...).
+    # With trace_memory=True the peak bytes allocated inside each stage are
+    # measured with tracemalloc, which slows numpy-heavy code down noticeably.
+
+    def __init__(self, callback=None, trace_memory=False):
+        self.callback = callback
+        self.trace_memory = trace_memory
+        self.report = None
+        self.last_report = None
+        self._start = None
+
+    def begin(self, audio_duration):
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        self.report = ProcessReport(audio_duration)
+        self._start = time.perf_counter()
+
+    def end(self):
+        report = self.report
+        if report is None:
+            return None
+        report.total_seconds = time.perf_counter() - self._start
+        self.report = None
+        self.last_report = report
+        if self.callback is not None:
+            self.callback(report)
+        return report
+
+    @contextmanager
+    def stage(self, name, input_size=None):
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            allocated = tracemalloc.get_traced_memory()[1] - before if self.trace_memory else None
+            if self.report is not None:
+                self.report.stages.append(StageRecord(name, seconds, input_size, allocated))
@@ -0,0 +1,85 @@
+import numpy as np
+
+# The original loop implementations replaced by the vectorized code, kept as
+# the oracles of tests/ and the baselines timed by benchmark.py.
+
+
+def reference_pianoroll(states, midi_min, hop_time):
+    # the original frame-by-frame walk of _convert_states_to_pianoroll:
+    # [onset, offset, midi (float), note name] per note
+    import librosa
+
+    states_ = np.hstack((states, np.zeros(1)))
+
+    #states
+    silence = 0
+    onset = 1
+    sustain = 2
+
+    my_state = silence
+    output = []
+
+    last_onset = 0
+    last_midi = 0
+    last_note = None
+    for i, state in enumerate(states_):
+        if my_state == silence:
+            if int(state % 2) != 0:
+                # achou inicio
+                last_onset = i * hop_time
+                last_midi = ((state - 1) / 2) + midi_min
+                last_note = librosa.midi_to_note(last_midi)
+                my_state = onset
+
+        elif my_state == onset:
+            if int(state % 2) == 0:
+                my_state = sustain
+
+        elif my_state == sustain:
+            if int(state % 2) != 0:
+                # achou inicio
+                # para a nota anterior
+                output.append([last_onset, i * hop_time, last_midi, last_note])
+
+                # comeca a nova nota
+                last_onset = i * hop_time
+                last_midi = ((state - 1) / 2) + midi_min
+                last_note = librosa.midi_to_note(last_midi)
+                my_state = onset
+
+            elif state == 0:
+                # achou silencio.
+                # para a nota anterior.
+                output.append([last_onset, i * hop_time, last_midi, last_note])
+                my_state = silence
+
+    return output
+
+
+def reference_emission(f0_, voiced_flag, onset_backtrack, midi_min, n_notes, pitch_acc, voiced_acc, onset_acc,
+                       spread):
+    # the original per-frame/per-note loop of _calc_probabilities
+    P = np.ones((n_notes * 2 + 1, len(f0_)))
+
+    for t in range(len(f0_)):
+        if voiced_flag[t] == False:
+            P[0, t] = voiced_acc
+        else:
+            P[0, t] = 1 - voiced_acc
+
+        for j in range(n_notes):
+            if t in onset_backtrack:
+                P[(j * 2) + 1, t] = onset_acc
+            else:
+                P[(j * 2) + 1, t] = 1 - onset_acc
+
+            if j + midi_min == f0_[t]:
+                P[(j * 2) + 2, t] = pitch_acc
+
+            elif np.abs(j + midi_min - f0_[t]) == 1:
+                P[(j * 2) + 2, t] = pitch_acc * spread
+
+            else:
+                P[(j * 2) + 2, t] = 1 - pitch_acc
+
+    return P
@@ -0,0 +1,115 @@
+import threading
+
+import numpy as np
+
+
+class RingBuffer():
+    # Fixed-capacity single-producer / single-consumer sample buffer.
+    #
+    # The producer (the sounddevice callback) only calls write(), which copies
+    # the block in place and never allocates. The consumer calls peek() to get
+    # a view of the unread samples and advance() once it is done with them.
+    # Each side only moves its own counter, so no lock is needed.
+    #
+    # The storage is mirrored (sample i is also kept at i + capacity), so any
+    # window of up to `capacity` samples is contiguous and peek() never copies.
+    #
+    # The consumer can block in wait_for() until enough samples are ready; the
+    # producer only signals when a waiter's threshold has been reached.
+
+    def __init__(self, capacity, dtype=np.float32):
+        self.capacity = int(capacity)
+        self.dtype = np.dtype(dtype)
+        self._buffer = np.zeros(2 * self.capacity, dtype=self.dtype)
+        self._written = 0
+        self._read = 0
+        self.overruns = 0
+        self.dropped = 0
+        self.closed = False
+        self._wanted = None
+        self._ready = threading.Event()
+
+    def available(self):
+        return self._written - self._read
+
+    def free(self):
+        return self.capacity - self.available()
+
+    def write(self, block):
+        n = len(block)
+        space = self.free()
+        if n > space:
+            # consumer is behind: keep what fits, count the rest as lost
+            self.overruns += 1
+            self.dropped += n - space
+            n = space
+            block = block[:n]
+        if n == 0:
+            return 0
+
+        cap = self.capacity
+        start = self._written % cap
+        end = start + n
+        self._buffer[start:end] = block
+
+        # mirror copy
+        if end <= cap:
+            self._buffer[start + cap:end + cap] = block
+        else:
+            split = cap - start
+            self._buffer[start + cap:] = block[:split]
+            self._buffer[:end - cap] = block[split:]
+
+        # publish only after the samples are in place
+        self._written += n
+
+        wanted = self._wanted
+        if wanted is not None and self.available() >= wanted:
+            self._ready.set()
+        return n
+
+    def wait_for(self, n, timeout=None):
+        # Blocks until n samples can be read. Returns False on timeout, or when
+        # the buffer was closed and fewer than n samples are left.
+        n = min(n, self.capacity)
+        self._wanted = n
+        try:
+            while self.available() < n:
+                if self.closed:
+                    return False
+                self._ready.clear()
+                # re-check after clear() so a write in between is not missed
+                if self.available() >= n or self.closed:
+                    continue
+                if not self._ready.wait(timeout):
+                    return False
+            return True
+        finally:
+            self._wanted = None
+
+    def close(self):
+        # producer is done: wake the consumer so it can drain and stop
+        self.closed = True
+        self._ready.set()
+
+    def peek(self, n=None):
+        available = self.available()
+        if n is None or n > available:
+            n = available
+        start = self._read % self.capacity
+        return self._buffer[start:start + n]
+
+    def advance(self, n):
+        n = min(n, self.available())
+        self._read += n
+        return n
+
+    def read(self, n=None):
+        # copy of the next n samples, consumed
+        block = self.peek(n).copy()
+        self.advance(len(block))
+        return block
+
+    def reset_counters(self):
+        self.overruns = 0
+        self.dropped = 0
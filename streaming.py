@@ -0,0 +1,188 @@
+from collections import deque
+
+import numpy as np
+import librosa
+
+from notes_process import PIANOROLL_DTYPE, NotesProcess, note_names
+from note_hmm import note_viterbi
+
+
+class NoteTracker():
+    # Incremental version of NotesProcess._convert_states_to_pianoroll:
+    # receives the decoded states one frame at a time and returns each note as
+    # soon as it ends, as a PIANOROLL_DTYPE record ('name' indexes
+    # note_names(midi_min, midi_max)).
+
+    silence = 0
+    onset = 1
+    sustain = 2
+
+    def __init__(self, midi_min, hop_time):
+        self.midi_min = midi_min
+        self.hop_time = hop_time
+        self.my_state = self.silence
+        self.last_onset = 0
+        self.last_index = 0
+
+    def _start(self, state, frame):
+        self.last_onset = frame * self.hop_time
+        self.last_index = (int(state) - 1) // 2
+        self.my_state = self.onset
+
+    def _note(self, frame):
+        return np.array((self.last_onset, frame * self.hop_time, self.last_index + self.midi_min, self.last_index),
+                        dtype=PIANOROLL_DTYPE)[()]
+
+    def feed(self, state, frame):
+        if self.my_state == self.silence:
+            if int(state % 2) != 0:
+                self._start(state, frame)
+
+        elif self.my_state == self.onset:
+            if int(state % 2) == 0:
+                self.my_state = self.sustain
+
+        elif self.my_state == self.sustain:
+            if int(state % 2) != 0:
+                note = self._note(frame)
+                self._start(state, frame)
+                return note
+
+            elif state == 0:
+                self.my_state = self.silence
+                return self._note(frame)
+
+        return None
+
+    def finish(self, frame):
+        # same as the trailing silence frame appended by _convert_states_to_pianoroll
+        return self.feed(0, frame)
+
+
+class StreamingTranscriber():
+    # Fixed-lag online transcription.
+    # Audio is pushed in arbitrary chunks. Features are computed only for the
+    # new frames, re-analysing `context_frames` of history so pyin and the onset
+    # detector see real signal on the left, and holding back `lookahead_frames`
+    # until enough signal exists on the right. The HMM keeps its Viterbi scores
+    # across chunks and the state of frame t is decided at t + lag.
+
+    def __init__(self, sr, notes_process=None, lag=0.25, callback=None, context_frames=16, lookahead_frames=8,
+                 keep_notes=True):
+        self.sr = sr
+        self.notes_p = notes_process if notes_process is not None else NotesProcess()
+        self.callback = callback
+        self.hop_length = self.notes_p.hop_length
+        self.lag_frames = max(1, int(round(lag * sr / self.hop_length)))
+        self.context_frames = max(context_frames, int(np.ceil(self.notes_p.frame_length / 2 / self.hop_length)))
+        self.lookahead_frames = lookahead_frames
+
+        self.midi_min = librosa.note_to_midi(self.notes_p.minimum_note)
+        self.n_notes = librosa.note_to_midi(self.notes_p.max_note) - self.midi_min + 1
+        self.decoder = note_viterbi(self.n_notes, self.notes_p.p_stay_note, self.notes_p.p_stay_silence)
+        self.tracker = NoteTracker(self.midi_min, self.hop_length / sr)
+        # note name of every 'name' index of the notes
+        self.names = note_names(self.midi_min, self.midi_min + self.n_notes - 1)
+
+        self.audio = np.zeros(0, dtype=np.float32)
+        self.audio_start = 0      # global sample index of self.audio[0], multiple of hop_length
+        self.next_frame = 0       # first frame without features yet
+        self.value = None
+        self.ptrs = deque(maxlen=self.lag_frames)
+        self.n_decoded = 0        # frames that went through the decoder
+        self.n_decided = 0        # frames whose state is final
+        self.keep_notes = keep_notes
+        self.notes = []
+
+    def push(self, y):
+        self.audio = np.concatenate((self.audio, np.asarray(y, dtype=np.float32)))
+        total = self.audio_start + len(self.audio)
+        last_frame = (total - self.notes_p.frame_length // 2) // self.hop_length - self.lookahead_frames
+        return self._analyse(last_frame + 1)
+
+    def flush(self):
+        # end of stream: analyse every remaining frame and decide all pending states
+        total = self.audio_start + len(self.audio)
+        new_notes = self._analyse(1 + total // self.hop_length)
+
+        if self.value is not None:
+            states = self._backtrack()
+            for i, state in enumerate(states):
+                self._emit(state, self.n_decided + i, new_notes)
+            self.n_decided += len(states)
+
+        note = self.tracker.finish(self.n_decided)
+        if note is not None:
+            self._emit_note(note, new_notes)
+        return new_notes
+
+    def _analyse(self, stop_frame):
+        new_notes = []
+        if stop_frame <= self.next_frame:
+            return new_notes
+
+        profiler = self.notes_p.profiler
+        if profiler is not None:
+            profiler.begin((stop_frame - self.next_frame) * self.hop_length / self.sr)
+
+        first_frame = self.audio_start // self.hop_length
+        features = self.notes_p._extract_features(self.audio, self.sr, self.notes_p.minimum_note,
+                                                  self.notes_p.max_note, self.notes_p.frame_length,
+                                                  self.notes_p.window_length, self.hop_length)
+        f0 = features['f0']
+        stop_frame = min(stop_frame, first_frame + len(f0))
+        start, stop = self.next_frame - first_frame, stop_frame - first_frame
+
+        with self.notes_p._stage('emission', stop - start):
+            tuning = librosa.pitch_tuning(f0)
+            f0_ = np.round(librosa.hz_to_midi(f0[start:stop] - tuning)).astype(int)
+            onsets = np.asarray(features['onset_backtrack']) - start
+            emission = self.notes_p._build_emission(f0_, features['voiced_flag'][start:stop], onsets, self.midi_min,
+                                                    self.n_notes, self.notes_p.pitch_acc, self.notes_p.voiced_acc,
+                                                    self.notes_p.onset_acc, self.notes_p.spread, compact=True)
+        with self.notes_p._stage('viterbi', stop - start):
+            self._decode(emission, new_notes)
+
+        self.next_frame = stop_frame
+        keep_from = max(0, self.next_frame - self.context_frames) * self.hop_length
+        if keep_from > self.audio_start:
+            self.audio = self.audio[keep_from - self.audio_start:]
+            self.audio_start = keep_from
+
+        if profiler is not None:
+            profiler.end()
+        return new_notes
+
+    def _decode(self, emission, new_notes):
+        for column in emission:
+            if self.value is None:
+                self.value = self.decoder.initial_value(column)
+            else:
+                if len(self.ptrs) == self.lag_frames:
+                    # the oldest pointer leaves the window: its frame gets decided now
+                    state = self._backtrack()[0]
+                    self._emit(state, self.n_decided, new_notes)
+                    self.n_decided += 1
+                self.value, ptr = self.decoder.step(self.value, column)
+                self.ptrs.append(ptr)
+            self.n_decoded += 1
+
+    def _backtrack(self):
+        # best path over the undecided frames, oldest first
+        states = np.zeros(len(self.ptrs) + 1, dtype=np.uint16)
+        states[-1] = np.argmax(self.value)
+        for i in range(len(self.ptrs) - 1, -1, -1):
+            states[i] = self.ptrs[i][states[i + 1]]
+        return states
+
+    def _emit(self, state, frame, new_notes):
+        note = self.tracker.feed(state, frame)
+        if note is not None:
+            self._emit_note(note, new_notes)
+
+    def _emit_note(self, note, new_notes):
+        if self.keep_notes:
+            self.notes.append(note)
+        new_notes.append(note)
+        if self.callback is not None:
+            self.callback(note)
@@ -0,0 +1,165 @@
+import argparse
+import csv
+import itertools
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import librosa
+
+from evaluation import DEFAULT_TOLERANCE, onset_scores, read_midi_onsets
+from notes_process import NotesProcess
+
+PARAMS = ('voiced_acc', 'onset_acc', 'pitch_acc', 'spread', 'p_stay_note', 'p_stay_silence')
+
+_features = None
+_tolerance = DEFAULT_TOLERANCE
+
+
+def extract(path, cache_dir=None, reference_dir=None):
+    # Everything that does not depend on the HMM parameters, computed once per file.
+    notes_p = NotesProcess()
+    if cache_dir is not None:
+        from feature_cache import FeatureCache
+        notes_p.feature_cache = FeatureCache(cache_dir)
+
+    y, sr = librosa.load(path)
+    features = notes_p._extract_features(y, sr, notes_p.minimum_note, notes_p.max_note, notes_p.frame_length,
+                                         notes_p.window_length, notes_p.hop_length)
+    features = {name: np.asarray(value) for name, value in features.items()}
+    features['sr'] = sr
+    # reference onsets: ground truth <reference_dir>/<name>.mid when given, else the onset detector
+    if reference_dir is not None:
+        reference = os.path.join(reference_dir, os.path.splitext(os.path.basename(path))[0] + '.mid')
+        features['onset_times'] = read_midi_onsets(reference)
+    else:
+        features['onset_times'] = librosa.frames_to_time(features['onset_backtrack'], sr=sr)
+    return features
+
+
+def evaluate(features, params, tolerance=DEFAULT_TOLERANCE):
+    notes_p = NotesProcess()
+    for name, value in params.items():
+        setattr(notes_p, name, value)
+
+    prob = notes_p._calc_emission(features, notes_p.minimum_note, notes_p.max_note, notes_p.pitch_acc,
+                                  notes_p.voiced_acc, notes_p.onset_acc, notes_p.spread)
+    states = notes_p._decode(prob, notes_p.minimum_note, notes_p.max_note, notes_p.p_stay_note, notes_p.p_stay_silence)
+    piano_format = notes_p.piano_roll(features['sr'], states)
+
+    scores = onset_scores(piano_format['onset'], features['onset_times'], tolerance)
+    return {
+        'n_notes': len(piano_format),
+        'n_onsets': scores['n_reference'],
+        'onset_matches': scores['matches'],
+        'precision': scores['precision'],
+        'recall': scores['recall'],
+        'f_measure': scores['f_measure'],
+    }
+
+
+def _init_worker(features, tolerance):
+    global _features, _tolerance
+    _features = features
+    _tolerance = tolerance
+
+
+def _run(path, params):
+    start = time.perf_counter()
+    result = evaluate(_features[path], params, _tolerance)
+    result['seconds'] = time.perf_counter() - start
+    return path, params, result
+
+
+def grid(values):
+    names = list(values)
+    for combination in itertools.product(*(values[name] for name in names)):
+        yield dict(zip(names, combination))
+
+
+def random_sample(values, n_samples, seed=None):
+    # values[name] is a list to choose from or a (low, high) range to draw from
+    rng = random.Random(seed)
+    for _ in range(n_samples):
+        params = {}
+        for name, value in values.items():
+            if isinstance(value, tuple):
+                params[name] = rng.uniform(*value)
+            else:
+                params[name] = rng.choice(value)
+        yield params
+
+
+def sweep(paths, param_sets, out_csv, workers=None, cache_dir=None, reference_dir=None, tolerance=DEFAULT_TOLERANCE):
+    param_sets = list(param_sets)
+    param_names = sorted({name for params in param_sets for name in params}, key=PARAMS.index)
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        features = dict(zip(paths, pool.map(extract, paths, itertools.repeat(cache_dir), itertools.repeat(reference_dir))))
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(features, tolerance)) as pool, \
+            open(out_csv, 'w', newline='') as output_file:
+        writer = csv.writer(output_file)
+        writer.writerow(['file'] + param_names + ['n_notes', 'n_onsets', 'onset_matches', 'precision', 'recall',
+                                                  'f_measure', 'seconds'])
+
+        jobs = [pool.submit(_run, path, params) for path in paths for params in param_sets]
+        for job in jobs:
+            path, params, result = job.result()
+            writer.writerow([path] + [params.get(name, '') for name in param_names] +
+                            [result['n_notes'], result['n_onsets'], result['onset_matches']] +
+                            ['{:.4f}'.format(result[name]) for name in ('precision', 'recall', 'f_measure', 'seconds')])
+
+    return len(paths) * len(param_sets)
+
+
+def parse_param(text):
+    # voiced_acc=0.8,0.9,0.95  -> list of values (grid or random choice)
+    # voiced_acc=0.8:0.95      -> uniform range (random sampling only)
+    name, _, spec = text.partition('=')
+    if name not in PARAMS:
+        raise argparse.ArgumentTypeError('unknown parameter {}, expected one of {}'.format(name, ', '.join(PARAMS)))
+    try:
+        if ':' in spec:
+            low, high = spec.split(':')
+            return name, (float(low), float(high))
+        return name, [float(v) for v in spec.split(',')]
+    except ValueError:
+        raise argparse.ArgumentTypeError('invalid values for {}: {}'.format(name, spec))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Evaluate many HMM parameter sets over the same recordings.')
+    parser.add_argument('files', nargs='+', help='audio files')
+    parser.add_argument('-p', '--param', type=parse_param, action='append', default=[],
+                        help='name=v1,v2,... or name=low:high (random mode)')
+    parser.add_argument('-n', '--random', type=int, metavar='N',
+                        help='draw N random parameter sets instead of the full grid')
+    parser.add_argument('--seed', type=int, help='random seed')
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count(), help='worker processes')
+    parser.add_argument('-o', '--output', default='sweep.csv', help='CSV output file')
+    parser.add_argument('--cache-dir', help='feature cache directory')
+    parser.add_argument('--reference-dir', help='ground truth MIDI files, named like the audio files '
+                                                '(default: score against the detected onsets)')
+    parser.add_argument('-t', '--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                        help='onset matching tolerance in seconds')
+    args = parser.parse_args()
+
+    values = dict(args.param)
+    if args.random:
+        param_sets = random_sample(values, args.random, args.seed)
+    else:
+        if any(isinstance(v, tuple) for v in values.values()):
+            parser.error('ranges (low:high) need --random')
+        param_sets = grid(values)
+
+    start = time.perf_counter()
+    n_runs = sweep(args.files, param_sets, args.output, workers=args.jobs, cache_dir=args.cache_dir,
+                   reference_dir=args.reference_dir, tolerance=args.tolerance)
+    print('{} runs in {:.1f}s -> {}'.format(n_runs, time.perf_counter() - start, args.output))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,32 @@
+import os
+import sys
+import warnings
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+RECORDINGS = ['escalamr.wav', 'track3-estrofe.wav']
+
+_features = {}
+
+
+def load_features(name):
+    # pyin is the slow part, so every recording is analysed once per session
+    if name not in _features:
+        import librosa
+        from notes_process import NotesProcess
+        notes_p = NotesProcess()
+        y, sr = librosa.load(os.path.join(ROOT, name))
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            _features[name] = notes_p._extract_features(y, sr, notes_p.minimum_note, notes_p.max_note,
+                                                        notes_p.frame_length, notes_p.window_length,
+                                                        notes_p.hop_length)
+    return _features[name]
+
+
+@pytest.fixture(params=RECORDINGS)
+def features(request):
+    return load_features(request.param)
@@ -0,0 +1,40 @@
+import warnings
+
+import librosa
+import numpy as np
+
+from notes_process import NotesProcess
+
+
+def _notes(features, adaptive_range):
+    notes_p = NotesProcess()
+    notes_p.adaptive_range = adaptive_range
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        prob = notes_p._calc_emission(features, notes_p.minimum_note, notes_p.max_note, notes_p.pitch_acc,
+                                      notes_p.voiced_acc, notes_p.onset_acc, notes_p.spread, compact=True)
+    states = notes_p._decode(prob, notes_p.states_range[0], notes_p.states_range[1], notes_p.p_stay_note,
+                             notes_p.p_stay_silence, model_notes=notes_p.model_notes())
+    return notes_p._convert_states_to_pianoroll(states, notes_p.minimum_note, notes_p.max_note, notes_p.hop_length / 22050,
+                                                notes_p.states_range[0]), notes_p.states_range
+
+
+def test_same_notes_as_full_range(features):
+    # no tie between sustains on the bundled recordings (see NotesProcess._occupied_range)
+    full, full_range = _notes(features, False)
+    pruned, states_range = _notes(features, True)
+    assert full_range == ('A2', 'E6')
+    assert librosa.note_to_midi(states_range[1]) - librosa.note_to_midi(states_range[0]) < 45
+    assert np.array_equal(pruned, full)
+
+
+def test_occupied_range():
+    notes_p = NotesProcess()
+    voiced = np.array([True, True, True, False, True])
+    # margin 2 around 60..64, the unvoiced frame is ignored
+    assert notes_p._occupied_range(np.array([60, 64, 62, 30, 62]), voiced, 45, 88, 2) == (58, 66)
+    # one semitone outside counts as the edge note, further away is dropped
+    assert notes_p._occupied_range(np.array([44, 60, 60, 60, 89]), voiced, 45, 88, 2) == (45, 88)
+    assert notes_p._occupied_range(np.array([30, 60, 60, 60, 100]), voiced, 45, 88, 2) == (58, 62)
+    # nothing voiced in range: the full range
+    assert notes_p._occupied_range(np.array([30, 100, 30, 60, 100]), voiced, 45, 88, 2) == (45, 88)
@@ -0,0 +1,85 @@
+import numpy as np
+
+from note_hmm import NoteEmission, note_viterbi
+
+N_NOTES = 6
+N_STATES = 2 * N_NOTES + 1
+
+
+def _probs(rng, lengths):
+    # few distinct values, so ties are frequent
+    return [rng.choice([0.1, 0.5, 0.5, 1.0], size=(N_STATES, n)) for n in lengths]
+
+
+def _emissions(rng, lengths):
+    log_values = np.log([0.9, 0.1, 0.8, 0.2, 0.99, 0.6, 0.01])
+    return [NoteEmission(rng.random(n) < 0.7, rng.random(n) < 0.1, rng.integers(-3, N_NOTES + 3, n), N_NOTES,
+                         log_values) for n in lengths]
+
+
+def _assert_same(decoded, probs, decoder, log_domain=False):
+    assert len(decoded) == len(probs)
+    for path, prob in zip(decoded, probs):
+        if prob.shape[1] == 0:
+            assert len(path) == 0
+        else:
+            assert np.array_equal(path, decoder.decode(prob, log_domain=log_domain))
+
+
+def test_matches_decode():
+    rng = np.random.default_rng(0)
+    decoder = note_viterbi(N_NOTES, 0.5, 0.5)
+    probs = _probs(rng, [1, 30, 7, 30, 52, 2])
+    _assert_same(decoder.decode_batch(probs), probs, decoder)
+
+
+def test_zero_length():
+    rng = np.random.default_rng(1)
+    decoder = note_viterbi(N_NOTES, 0.13, 0.87)
+    probs = _probs(rng, [0, 12, 0, 5])
+    _assert_same(decoder.decode_batch(probs), probs, decoder)
+    _assert_same(decoder.decode_batch(probs[:1]), probs[:1], decoder)
+
+
+def test_group_splitting():
+    # every group limit from one sequence per group to all of them together
+    rng = np.random.default_rng(2)
+    decoder = note_viterbi(N_NOTES, 0.13, 0.87)
+    probs = _probs(rng, rng.integers(0, 40, 25))
+    for max_padded_frames in (1, 10, 39, 40, 100, 400, 10000):
+        _assert_same(decoder.decode_batch(probs, max_padded_frames=max_padded_frames), probs, decoder)
+
+
+def test_padded_input():
+    rng = np.random.default_rng(3)
+    decoder = note_viterbi(N_NOTES, 0.13, 0.87)
+    lengths = [20, 3, 0, 20, 11]
+    padded = rng.random((len(lengths), N_STATES, 20))
+    probs = [prob[:, :n] for prob, n in zip(padded, lengths)]
+    _assert_same(decoder.decode_batch(padded, lengths), probs, decoder)
+    _assert_same(decoder.decode_batch(padded), list(padded), decoder)
+
+
+def test_log_domain_float32():
+    rng = np.random.default_rng(4)
+    decoder = note_viterbi(N_NOTES, 0.05, 0.6)
+    probs = [np.log(prob).astype(np.float32) for prob in _probs(rng, [9, 25, 1, 25])]
+    _assert_same(decoder.decode_batch(probs, log_domain=True), probs, decoder, log_domain=True)
+
+
+def test_note_emission():
+    rng = np.random.default_rng(5)
+    decoder = note_viterbi(N_NOTES, 0.13, 0.87)
+    emissions = _emissions(rng, [15, 40, 2, 0, 33])
+    for max_padded_frames in (30, 10000):
+        decoded = decoder.decode_batch(emissions, max_padded_frames=max_padded_frames)
+        for path, emission in zip(decoded, emissions):
+            if len(emission) == 0:
+                assert len(path) == 0
+            else:
+                assert np.array_equal(path, decoder.decode(emission))
+    # mixed with dense matrices of the same columns
+    dense = [np.exp(emission.dense()) for emission in emissions[:3]]
+    decoded = decoder.decode_batch(emissions[:3] + dense)
+    for a, b in zip(decoded[:3], decoded[3:]):
+        assert np.array_equal(a, b)
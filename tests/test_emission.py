@@ -0,0 +1,26 @@
+import warnings
+
+import librosa
+import numpy as np
+
+from notes_process import NotesProcess
+from reference import reference_emission
+
+
+def _f0_notes(f0):
+    with warnings.catch_warnings():
+        # nan (unvoiced) frames cast to int, as in _calc_emission
+        warnings.simplefilter('ignore')
+        return np.round(librosa.hz_to_midi(f0 - librosa.pitch_tuning(f0))).astype(int)
+
+
+def test_build_emission_matches_loop(features):
+    notes_p = NotesProcess()
+    expected = reference_emission(_f0_notes(features['f0']), features['voiced_flag'], features['onset_backtrack'],
+                                  librosa.note_to_midi(notes_p.minimum_note), notes_p.model_notes(), notes_p.pitch_acc, notes_p.voiced_acc, notes_p.onset_acc,
+                                  notes_p.spread)
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        P = notes_p._calc_emission(features, notes_p.minimum_note, notes_p.max_note, notes_p.pitch_acc,
+                                   notes_p.voiced_acc, notes_p.onset_acc, notes_p.spread)
+    assert np.array_equal(P, expected)
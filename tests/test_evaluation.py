@@ -0,0 +1,47 @@
+import numpy as np
+from scipy.optimize import linear_sum_assignment
+
+from evaluation import match_onsets, read_midi_notes
+from midi_writer import write_midi
+from notes_process import PIANOROLL_DTYPE
+
+
+def _max_matches(estimated, reference, tolerance):
+    # brute-force maximum one-to-one assignment within the tolerance window
+    if len(estimated) == 0 or len(reference) == 0:
+        return 0
+    close = np.abs(np.subtract.outer(estimated, reference)) <= tolerance
+    rows, cols = linear_sum_assignment(-close.astype(int))
+    return int(close[rows, cols].sum())
+
+
+def test_greedy_matching_is_optimal():
+    rng = np.random.default_rng(0)
+    # a coarse binary grid: exact window edges are frequent and compared without rounding
+    tolerance = 3 / 64
+    for _ in range(500):
+        estimated = rng.integers(0, 40, int(rng.integers(0, 12))) / 64
+        reference = rng.integers(0, 40, int(rng.integers(0, 12))) / 64
+        pairs = match_onsets(estimated, reference, tolerance)
+        estimated_sorted, reference_sorted = np.sort(estimated), np.sort(reference)
+        assert len({i for i, _ in pairs}) == len({j for _, j in pairs}) == len(pairs)
+        assert all(abs(estimated_sorted[i] - reference_sorted[j]) <= tolerance for i, j in pairs)
+        assert len(pairs) == _max_matches(estimated_sorted, reference_sorted, tolerance)
+
+
+def test_midi_round_trip(tmp_path):
+    rng = np.random.default_rng(1)
+    notes = np.empty(50, dtype=PIANOROLL_DTYPE)
+    times = np.cumsum(rng.random(100) * 0.5)
+    notes['onset'], notes['offset'] = times[0::2], times[1::2]
+    notes['midi'] = rng.integers(45, 89, 50)
+    notes['name'] = notes['midi'] - 45
+    path = str(tmp_path / 'notes.mid')
+    bpm = 97.0
+    write_midi(notes, path, bpm)
+
+    onsets, pitches = read_midi_notes(path)
+    assert np.array_equal(pitches, notes['midi'])
+    # onsets are rounded down to a tick
+    tick = 60 / bpm / 960
+    assert np.all((notes['onset'] - onsets >= -1e-9) & (notes['onset'] - onsets < tick))
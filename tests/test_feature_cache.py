@@ -0,0 +1,59 @@
+import os
+
+import numpy as np
+
+from feature_cache import FeatureCache
+
+
+def _features(value, n=1000):
+    return {'f0': np.full(n, value, dtype=np.float64), 'voiced_flag': np.ones(n, dtype=bool)}
+
+
+def test_hit_and_miss(tmp_path):
+    cache = FeatureCache(str(tmp_path))
+    y = np.arange(100, dtype=np.float32)
+    key = cache.key(y, 22050, hop_length=512)
+    assert key == cache.key(y.copy(), 22050, hop_length=512)
+    assert key != cache.key(y, 22050, hop_length=256)
+    assert key != cache.key(y.astype(np.float64), 22050, hop_length=512)
+
+    assert cache.get(key) is None
+    cache.put(key, _features(1.0))
+    features = cache.get(key)
+    # memory mapped and read-only
+    assert isinstance(features['f0'], np.memmap)
+    assert not features['f0'].flags.writeable
+    assert np.array_equal(features['f0'], _features(1.0)['f0'])
+    assert features['voiced_flag'].dtype == bool
+    assert cache.stats()['hits'] == 1 and cache.stats()['misses'] == 1
+
+    features = FeatureCache(str(tmp_path), mmap=False).get(key)
+    assert not isinstance(features['f0'], np.memmap)
+
+
+def test_eviction(tmp_path):
+    cache = FeatureCache(str(tmp_path), max_bytes=10 ** 9)
+    for i in range(3):
+        cache.put(str(i), _features(float(i)))
+        # oldest first on the mtime LRU clock
+        os.utime(os.path.join(str(tmp_path), str(i)), (1000 + i, 1000 + i))
+    entry_bytes = cache.size() // 3
+
+    # reading '0' makes it the most recently used
+    assert cache.get('0') is not None
+    cache.max_bytes = 2 * entry_bytes
+    cache.evict()
+    assert cache.get('1') is None
+    assert cache.get('0') is not None and cache.get('2') is not None
+    assert cache.evictions == 1
+    assert cache.stats()['entries'] == 2
+
+
+def test_concurrent_writer_keeps_first_entry(tmp_path):
+    cache = FeatureCache(str(tmp_path))
+    other = FeatureCache(str(tmp_path))
+    cache.put('k', _features(1.0))
+    # the second writer's os.replace fails on the existing entry: its temporary directory goes away
+    other.put('k', _features(2.0))
+    assert cache.get('k')['f0'][0] == 1.0
+    assert not [name for name in os.listdir(str(tmp_path)) if name.startswith('.tmp-')]
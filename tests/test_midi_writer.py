@@ -0,0 +1,78 @@
+import io
+
+import midiutil
+import numpy as np
+import pytest
+
+from midi_writer import MidiWriter, encode_midi
+from notes_process import PIANOROLL_DTYPE
+
+
+class _Pipe():
+    # write-only, not seekable (like a pipe or a socket file)
+
+    def __init__(self):
+        self.data = bytearray()
+
+    def write(self, data):
+        self.data += data
+
+    def flush(self):
+        pass
+
+
+def _pianoroll(rng, n):
+    # one note at a time, as the transcriber produces them: each one ends at or
+    # before the next onset (same-pitch overlaps also break midiutil)
+    times = np.cumsum(rng.choice([0.05, 0.2, 0.35, 1.0], 2 * n))
+    notes = np.empty(n, dtype=PIANOROLL_DTYPE)
+    notes['onset'] = times[0::2]
+    notes['offset'] = times[1::2]
+    # half of the notes end on the next onset
+    contiguous = np.flatnonzero(rng.random(max(n - 1, 0)) < 0.5)
+    notes['offset'][contiguous] = notes['onset'][contiguous + 1]
+    notes['midi'] = rng.integers(45, 89, n)
+    notes['name'] = notes['midi'] - 45
+    return notes
+
+
+def _midiutil(pianoroll, bpm):
+    # the old path (teste.py NotesProcess._convert_pianoroll_to_midi + writeFile)
+    quarter_note = 60 / bpm
+    midi = midiutil.MIDIFile(1)
+    midi.addTempo(0, 0, bpm)
+    for onset, offset, pitch in zip(pianoroll['onset'], pianoroll['offset'], pianoroll['midi']):
+        midi.addNote(0, 0, int(pitch), onset / quarter_note, offset / quarter_note - onset / quarter_note, 100)
+    output = io.BytesIO()
+    midi.writeFile(output)
+    return output.getvalue()
+
+
+@pytest.mark.parametrize('bpm', [60.0, 97.3, 143.5])
+def test_matches_midiutil(bpm):
+    rng = np.random.default_rng(int(bpm))
+    for n in (0, 1, 5, 200):
+        pianoroll = _pianoroll(rng, n)
+        assert encode_midi(pianoroll, bpm) == _midiutil(pianoroll, bpm)
+
+
+def test_seekable_and_stream_match():
+    pianoroll = _pianoroll(np.random.default_rng(0), 300)
+    pipe = _Pipe()
+    with MidiWriter(pipe, bpm=120.0, chunk_size=64) as writer:
+        writer.add_notes(pianoroll)
+    # seekable: written in small chunks, track length patched on close
+    seekable = io.BytesIO()
+    with MidiWriter(seekable, bpm=120.0, chunk_size=64) as writer:
+        writer.add_notes(pianoroll)
+    assert bytes(pipe.data) == seekable.getvalue() == encode_midi(pianoroll, 120.0)
+
+
+def test_out_of_order():
+    writer = MidiWriter(io.BytesIO(), bpm=120.0)
+    writer.add_note(1.0, 2.0, 60)
+    with pytest.raises(ValueError):
+        writer.add_note(0.5, 1.0, 62)
+    writer.close()
+    with pytest.raises(ValueError):
+        writer.add_note(3.0, 4.0, 60)
@@ -0,0 +1,45 @@
+import numpy as np
+
+from notes_process import NotesProcess, note_names
+from reference import reference_pianoroll
+from streaming import NoteTracker
+
+MIDI_MIN, MIDI_MAX = 45, 88
+HOP_TIME = 512 / 22050
+
+
+def _sequences(n):
+    # random state paths: runs of silence, onsets and sustains of a few notes,
+    # plus some that break the onset -> sustain order
+    rng = np.random.default_rng(0)
+    n_states = 2 * (MIDI_MAX - MIDI_MIN) + 3
+    for _ in range(n):
+        if rng.random() < 0.2:
+            yield rng.integers(0, n_states, int(rng.integers(0, 40)))
+            continue
+        states = []
+        while len(states) < 60:
+            note = int(rng.integers(0, 4))
+            kind = rng.integers(0, 3)
+            if kind == 0:
+                states += [0] * int(rng.integers(1, 5))
+            else:
+                states += [2 * note + 1] * int(rng.integers(1, 3)) + [2 * note + 2] * int(rng.integers(0, 5))
+        yield np.array(states)
+
+
+def _as_lists(notes, names):
+    return [[note['onset'], note['offset'], float(note['midi']), names[note['name']]] for note in notes]
+
+
+def test_matches_loop():
+    names = note_names(MIDI_MIN, MIDI_MAX)
+    for states in _sequences(2000):
+        expected = reference_pianoroll(states, MIDI_MIN, HOP_TIME)
+
+        notes = NotesProcess()._convert_states_to_pianoroll(states, 'A2', 'E6', HOP_TIME)
+        assert _as_lists(notes, names) == expected
+
+        tracker = NoteTracker(MIDI_MIN, HOP_TIME)
+        tracked = [tracker.feed(state, frame) for frame, state in enumerate(states)] + [tracker.finish(len(states))]
+        assert _as_lists([note for note in tracked if note is not None], names) == expected
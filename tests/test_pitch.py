@@ -0,0 +1,27 @@
+import librosa
+import numpy as np
+import pytest
+
+from pitch import get_pitch_backend, yin_backend
+
+SR = 22050
+ARGS = (librosa.note_to_hz('A2') * 0.9, librosa.note_to_hz('E6') * 1.1, 2048, 1024, 512)
+
+
+def test_yin_silence_is_unvoiced():
+    y = np.concatenate([np.zeros(SR), librosa.tone(220.0, sr=SR, duration=1.0), np.zeros(SR)])
+    f0, voiced_flag, voiced_prob = yin_backend(y, SR, *ARGS)
+    assert len(f0) == 1 + len(y) // 512
+    # frames that see only zeros
+    silent = np.r_[:20, len(f0) - 20:len(f0)]
+    assert not voiced_flag[silent].any()
+    assert np.all(voiced_prob[silent] == 0)
+    assert np.all(np.isnan(f0[silent]))
+    tone = slice(50, 80)
+    assert voiced_flag[tone].all()
+    assert np.allclose(f0[tone], 220.0, rtol=0.01)
+
+
+def test_unknown_backend():
+    with pytest.raises(ValueError):
+        get_pitch_backend('crepe')
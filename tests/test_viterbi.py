@@ -0,0 +1,75 @@
+import warnings
+
+import librosa
+import numpy as np
+import pytest
+
+from note_hmm import note_viterbi, transition_matrix
+from notes_process import NotesProcess
+
+# p_stay_note, p_stay_silence, pitch_acc, spread; the second set produces near-ties
+DEFAULT = (0.13, 0.87, 0.99, 0.6)
+NEAR_TIES = (0.05, 0.6, 0.8, 0.9)
+EVEN = (0.5, 0.5, 0.9, 0.5)
+
+
+def _states(features, params, log_domain=False, compact=False):
+    notes_p = NotesProcess()
+    notes_p.p_stay_note, notes_p.p_stay_silence, notes_p.pitch_acc, notes_p.spread = params
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        prob = notes_p._calc_emission(features, notes_p.minimum_note, notes_p.max_note, notes_p.pitch_acc,
+                                      notes_p.voiced_acc, notes_p.onset_acc, notes_p.spread, log_domain, compact)
+    return notes_p._decode(prob, notes_p.minimum_note, notes_p.max_note, notes_p.p_stay_note,
+                           notes_p.p_stay_silence, log_domain)
+
+
+@pytest.mark.parametrize('params', [DEFAULT, NEAR_TIES])
+def test_compact_matches_linear(features, params):
+    # float64 logs either way: the same path
+    assert np.array_equal(_states(features, params, compact=True), _states(features, params))
+
+
+def test_log_domain_matches_linear(features):
+    assert np.array_equal(_states(features, DEFAULT, log_domain=True), _states(features, DEFAULT))
+
+
+def test_log_domain_near_ties(features):
+    # float32 emissions can resolve a near-tie the other way (see NoteViterbi.decode)
+    log_states = _states(features, NEAR_TIES, log_domain=True)
+    states = _states(features, NEAR_TIES)
+    assert np.mean(log_states != states) <= 0.002
+
+
+def _dense_viterbi(prob, n_notes, p_stay_note, p_stay_silence):
+    # the original decoding (see teste.py NotesProcess.process)
+    p_init = np.zeros(2 * n_notes + 1)
+    p_init[0] = 1
+    return librosa.sequence.viterbi(prob, transition_matrix(n_notes, p_stay_note, p_stay_silence), p_init=p_init)
+
+
+@pytest.mark.parametrize('params', [DEFAULT, NEAR_TIES, EVEN])
+def test_matches_librosa_viterbi(features, params):
+    notes_p = NotesProcess()
+    notes_p.p_stay_note, notes_p.p_stay_silence, notes_p.pitch_acc, notes_p.spread = params
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        prob = notes_p._calc_emission(features, notes_p.minimum_note, notes_p.max_note, notes_p.pitch_acc,
+                                      notes_p.voiced_acc, notes_p.onset_acc, notes_p.spread)
+    states = notes_p._decode(prob, notes_p.minimum_note, notes_p.max_note, notes_p.p_stay_note,
+                             notes_p.p_stay_silence)
+    expected = _dense_viterbi(prob, notes_p.model_notes(), notes_p.p_stay_note, notes_p.p_stay_silence)
+    assert np.array_equal(states, expected)
+
+
+@pytest.mark.parametrize('params', [DEFAULT, NEAR_TIES, EVEN])
+def test_matches_librosa_viterbi_with_ties(params):
+    # emissions drawn from a few values, so equal scores are frequent: the >= in
+    # NoteViterbi.step has to pick the predecessor librosa's argmax picks
+    p_stay_note, p_stay_silence = params[:2]
+    rng = np.random.default_rng(0)
+    for _ in range(50):
+        n_notes = int(rng.integers(1, 8))
+        prob = rng.choice([0.1, 0.5, 0.5, 1.0], size=(2 * n_notes + 1, int(rng.integers(1, 60))))
+        states = note_viterbi(n_notes, p_stay_note, p_stay_silence).decode(prob)
+        assert np.array_equal(states, _dense_viterbi(prob, n_notes, p_stay_note, p_stay_silence))
@@ -1,9 +1,8 @@
 import argparse
+import threading
 
-import sounddevice as sd
 import numpy as np
-import teste as wtm
-import time
+from ring_buffer import RingBuffer
 
 
 def int_or_str(text):
@@ -20,6 +19,7 @@ parser.add_argument(
     help='show list of audio devices and exit')
 args, remaining = parser.parse_known_args()
 if args.list_devices:
+    import sounddevice as sd
     print(sd.query_devices())
     parser.exit(0)
 parser = argparse.ArgumentParser(
@@ -39,8 +39,13 @@ parser.add_argument('--dtype', help='audio data type')
 parser.add_argument('--samplerate', type=float, help='sampling rate')
 parser.add_argument('--blocksize', type=int, help='block size')
 parser.add_argument('--latency', type=float, help='latency in seconds')
+parser.add_argument('--buffer-seconds', type=float, default=10,
+                    help='capture buffer; it is drained continuously, the whole recording is kept')
 args = parser.parse_args(remaining)
 
+# only after parsing, so --help does not wait for PortAudio
+import sounddevice as sd
+
 figureOfTime = 1
 beats = 4
 going = 60
@@ -53,11 +58,25 @@ windowPerBeat = beatTime / windowSize
 
 twoCompasse = 2 * beats * windowPerBeat
 
-data = []
+data = RingBuffer(int(args.buffer_seconds * args.samplerate))
+xruns = 0
 def callback(indata, frames, time, status):
+    global xruns
     if status:
-        print(status)
-    data.append(np.frombuffer(indata, dtype=np.int16).astype(float))
+        xruns += 1
+    data.write(indata[:, 0])
+
+# moves the captured samples out of the ring as they arrive, so the ring
+# stays small and the recording is only limited by memory
+chunks = []
+def drain():
+    block = max(1, data.capacity // 4)
+    while data.wait_for(block):
+        chunks.append(data.read(block))
+    chunks.append(data.read())
+
+drainer = threading.Thread(target=drain)
+drainer.start()
 
 
 try:
@@ -72,14 +91,19 @@ try:
             # time.sleep(2 * beats * figureOfTime * beatTime)
             
 except KeyboardInterrupt:
+    data.close()
     parser.exit('')
 except Exception as e:
+    data.close()
     parser.exit(type(e).__name__ + ': ' + str(e))
 
+data.close()
+drainer.join()
 print('stop')
+print(f'xruns {xruns}, overruns {data.overruns} ({data.dropped} samples dropped)')
 
-rec = np.array((len(data)*args.samplerate,))
-rec = np.concatenate(np.squeeze(np.stack(data)))
+rec = np.concatenate(chunks).astype(float)
 
+import notes_process as pn
 
-wtm.main(buffer=rec, sr=args.samplerate)
+pn.NotesProcess().getNotesPianoFormart(y=rec, sr=args.samplerate)